@@ -1,6 +1,5 @@
 from flask import Flask
 from config import Config
-from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 import logging
@@ -10,14 +9,22 @@ from flask_mail import Mail
 from flask_bootstrap import Bootstrap
 from flask_moment import Moment
 from elasticsearch import Elasticsearch
+from app.cache import LRUCache
+from app.last_seen import LastSeen
+from app.email import MailWorker
+from app.replica import RoutingSQLAlchemy
+from app.sqlite import configure_sqlite
+from app.search import create_backend
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 migrate = Migrate()
 login = LoginManager()
 login.login_view = 'auth.login'
 mail = Mail()
 bootstrap = Bootstrap()
 moment = Moment()
+last_seen = LastSeen()
+mail_worker = MailWorker()
 
 def create_app(config_class=Config):
     app = Flask(__name__)
@@ -30,11 +37,15 @@ def create_app(config_class=Config):
             migrate.init_app(app, db, render_as_batch=True)
         else:
             migrate.init_app(app, db)
+        for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or ()):
+            configure_sqlite(db.get_engine(app, bind=bind), app.config)
 
     login.init_app(app)
     mail.init_app(app)
+    mail_worker.init_app(app)
     bootstrap.init_app(app)
     moment.init_app(app)
+    last_seen.init_app(app)
 
     from app.errors import bp as errors_bp
     app.register_blueprint(errors_bp)
@@ -47,6 +58,14 @@ def create_app(config_class=Config):
 
     app.elasticsearch = Elasticsearch([app.config['ELASTICSEARCH_URL']]) \
         if app.config['ELASTICSEARCH_URL'] else None
+    app.search = create_backend(app, db.get_engine(app))
+    app.analysis_cache = LRUCache(
+        app.config['ANALYSIS_CACHE_SIZE'], name='analysis cache',
+        logger=app.logger, log_interval=app.config['CACHE_LOG_INTERVAL'])
+    app.user_cache = LRUCache(
+        app.config['USER_CACHE_SIZE'], ttl=app.config['USER_CACHE_TTL'],
+        name='user cache', logger=app.logger,
+        log_interval=app.config['CACHE_LOG_INTERVAL'])
 
     from app import models
 
@@ -7,6 +7,7 @@ from app.auth.forms import LoginForm
 from flask_login import current_user, login_user, logout_user, login_required
 from app.models import User
 from app import db
+from app.conditional import invalidate_pages
 from app.auth import bp
 from app.auth.forms import RegistrationForm
 from app.models import Project
@@ -28,6 +29,7 @@ def login():
             flash('Invalid username, email or password')
             return redirect(url_for('auth.login'))
         login_user(user, remember=form.remember_me.data)
+        invalidate_pages()
         next_page = request.args.get('next')
         if not next_page or url_parse(next_page).netloc !='':
             next_page = url_for('main.index')
@@ -49,6 +51,7 @@ def register():
         user.set_password(form.password.data)
         db.session.add(user)
         db.session.commit()
+        user.uncache()
         flash('Congratulations, you are now a registered user!')
         return redirect(url_for('auth.login'))
     return render_template('auth/register.html', title='Register', form =form)
@@ -78,6 +81,7 @@ def reset_password(token):
     if form.validate_on_submit():
         user.set_password(form.password.data)
         db.session.commit()
+        user.uncache()
         flash('Your password has been reset.')
         return redirect(url_for('auth.login'))
     return render_template('auth/reset_password.html', form = form)
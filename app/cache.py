@@ -0,0 +1,77 @@
+"""Small in-process caches."""
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+
+class LRUCache():
+    """A cache holding at most maxsize entries. When it is full the
+    least recently used entry is evicted. With ttl set, entries older
+    than ttl seconds are treated as missing. With logger and
+    log_interval set, the counters of info() are logged at most every
+    log_interval seconds. Any object with the same get/set/delete
+    methods can be used in its place.
+
+    The cache lives in one process: other processes keep serving their
+    copy of an entry deleted here until it expires."""
+
+    def __init__(self, maxsize=128, ttl=None, clock=monotonic, name='cache',
+                 logger=None, log_interval=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.name = name
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._logger = logger
+        self._log_interval = log_interval
+        self._logged = clock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the value stored for key or default."""
+        with self._lock:
+            value, expires = self._entries.get(key, (default, None))
+            if key not in self._entries:
+                self.misses += 1
+            elif expires is not None and expires <= self._clock():
+                del self._entries[key]
+                self.misses += 1
+                value = default
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            log = (self._logger is not None and self._log_interval
+                   and self._clock() - self._logged >= self._log_interval)
+            if log:
+                self._logged = self._clock()
+        if log:
+            self._logger.info('%s: %r', self.name, self.info())
+        return value
+
+    def set(self, key, value):
+        """Store value for key, evicting old entries if necessary."""
+        expires = None if self.ttl is None else self._clock() + self.ttl
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Remove key from the cache."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def info(self):
+        """Return the hit and miss counters and the current size."""
+        return {'hits': self.hits, 'misses': self.misses,
+                'size': len(self), 'maxsize': self.maxsize}
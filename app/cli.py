@@ -0,0 +1,122 @@
+"""Command line interface of tawachai."""
+import os
+from time import monotonic
+import click
+from flask import current_app
+from app import db
+from app.graphs import CycleError
+from app.models import Project, Node
+from app.reindex import read_checkpoint, reindex, write_checkpoint
+from app.transfer import (FORMATS, export_records, import_records,
+                          read_records, write_records)
+
+
+def _format(name, format):
+    if format:
+        return format
+    extension = os.path.splitext(name)[1].lstrip('.').lower()
+    return extension if extension in FORMATS else 'jsonl'
+
+
+def _chunk_size():
+    return current_app.config['TRANSFER_CHUNK_SIZE']
+
+
+def register(app):
+    @app.cli.group()
+    def graph():
+        """Import and export project graphs."""
+        pass
+
+    @graph.command('import')
+    @click.argument('project_id', type=int)
+    @click.argument('source', type=click.File(encoding='utf-8'))
+    @click.option('--format', type=click.Choice(FORMATS),
+                  help='Defaults to the file extension or jsonl.')
+    @click.option('--chunk-size', type=int,
+                  help='Rows per statement, TRANSFER_CHUNK_SIZE by default.')
+    def import_graph(project_id, source, format, chunk_size):
+        """Import nodes and edges from a JSON Lines or CSV file."""
+        project = Project.query.get(project_id)
+        if project is None:
+            raise click.ClickException('No project {}'.format(project_id))
+        records = read_records(source, _format(source.name, format))
+        try:
+            nodes, edges = import_records(
+                project, records, chunk_size=chunk_size or _chunk_size())
+        except (ValueError, CycleError) as error:
+            db.session.rollback()
+            raise click.ClickException(str(error))
+        db.session.commit()
+        click.echo('Imported {} nodes and {} edges.'.format(nodes, edges))
+
+    @graph.command('export')
+    @click.argument('project_id', type=int)
+    @click.argument('target', type=click.File('w', encoding='utf-8',
+                                              lazy=True), default='-')
+    @click.option('--format', type=click.Choice(FORMATS),
+                  help='Defaults to the file extension or jsonl.')
+    @click.option('--chunk-size', type=int,
+                  help='Rows per statement, TRANSFER_CHUNK_SIZE by default.')
+    def export_graph(project_id, target, format, chunk_size):
+        """Export nodes and edges to a JSON Lines or CSV file."""
+        project = Project.query.get(project_id)
+        if project is None:
+            raise click.ClickException('No project {}'.format(project_id))
+        records = export_records(project,
+                                 chunk_size=chunk_size or _chunk_size())
+        for line in write_records(records, _format(target.name, format)):
+            target.write(line)
+
+    @app.cli.group()
+    def search():
+        """Search index commands."""
+        pass
+
+    searchable = {model.__tablename__: model for model in (Project, Node)}
+
+    @search.command('reindex')
+    @click.argument('indexes', nargs=-1,
+                    type=click.Choice(sorted(searchable)))
+    @click.option('--workers', default=1, show_default=True,
+                  type=click.IntRange(1),
+                  help='Threads indexing id ranges in parallel.')
+    @click.option('--range-size', default=10000, show_default=True,
+                  type=click.IntRange(1),
+                  help='Ids per range handed to a worker.')
+    @click.option('--chunk-size', default=1000, show_default=True,
+                  type=click.IntRange(1),
+                  help='Rows read and indexed at a time.')
+    @click.option('--checkpoint-dir', type=click.Path(file_okay=False),
+                  help='Where the last indexed id of each index is kept, '
+                  'the instance folder by default.')
+    @click.option('--restart', is_flag=True,
+                  help='Ignore checkpoints and start from the first id.')
+    def reindex_command(indexes, workers, range_size, chunk_size,
+                        checkpoint_dir, restart):
+        """Rebuild the search index, by default of all models. An
+        interrupted run continues after the last indexed id."""
+        if checkpoint_dir is None:
+            checkpoint_dir = current_app.instance_path
+            os.makedirs(checkpoint_dir, exist_ok=True)
+        for index in indexes or sorted(searchable):
+            model = searchable[index]
+            path = os.path.join(checkpoint_dir, '.reindex-' + index)
+            after = None if restart else read_checkpoint(path)
+            if after is not None:
+                click.echo('{}: resuming after id {}'.format(index, after))
+            query = model.query
+            if after is not None:
+                query = query.filter(model.id > after)
+            total = query.count()
+            started = monotonic()
+            for last_id, count in reindex(model, after, workers, range_size,
+                                          chunk_size):
+                write_checkpoint(path, last_id)
+                elapsed = monotonic() - started
+                click.echo('{}: {} of {} rows up to id {}, {:.0f} rows/s'
+                           .format(index, count, total, last_id,
+                                   count / elapsed if elapsed else 0))
+            if os.path.exists(path):
+                os.remove(path)
+            click.echo('{}: done'.format(index))
@@ -0,0 +1,67 @@
+"""Conditional GET for pages derived from the revision of a project."""
+from datetime import datetime
+from hashlib import sha1
+from time import time
+from flask import current_app, g, request, session
+from flask_login import current_user
+from werkzeug.http import is_resource_modified
+
+
+def invalidate_pages():
+    """Invalidate every page validator handed to this browser session,
+    after a login or a change to the current user."""
+    session['pages_since'] = int(time())
+
+
+def not_modified(project):
+    """Return a 304 response if the client holds the current version of
+    a GET page showing project, else None. The validators are added to
+    the response of the view by add_validators. Only the ETag is
+    compared, Last-Modified has a granularity of one second and would
+    hide changes made within the second of the last response."""
+    if request.method not in ('GET', 'HEAD') or '_flashes' in session:
+        return None
+    g.page_project = project
+    etag, _ = _validators(project)
+    if is_resource_modified(request.environ, etag):
+        return None
+    return current_app.response_class(status=304)
+
+
+def add_validators(response):
+    """Set ETag and Last-Modified on the response of a page checked
+    with not_modified."""
+    project = g.pop('page_project', None)
+    if project is None or response.status_code not in (200, 304) \
+            or '_flashes' in session:
+        return response
+    etag, last_modified = _validators(project)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    # the page differs per user, shared caches must not keep it
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    response.vary.add('Cookie')
+    return response
+
+
+def _validators(project):
+    """The strong ETag and the Last-Modified date of the page.
+
+    Besides the project revision the page depends on the user, on the
+    CSRF token of the session embedded in its forms and on the age of
+    that token, hence the time bucket."""
+    config = current_app.config
+    limit = config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    # a cached page keeps at least half of the token lifetime
+    bucket = int(time()) // (limit // 2) * (limit // 2) if limit else 0
+    since = session.get('pages_since', 0)
+    key = '{}|{}|{}|{}|{}|{}|{}|{}'.format(
+        request.path, project.id, project.revision, project.modified,
+        current_user.get_id(),
+        session.get(config.get('WTF_CSRF_FIELD_NAME', 'csrf_token')),
+        bucket, since)
+    last_modified = max(project.modified or project.timestamp,
+                        datetime.utcfromtimestamp(bucket),
+                        datetime.utcfromtimestamp(since))
+    return sha1(key.encode('utf-8')).hexdigest(), last_modified
@@ -1,15 +1,153 @@
+import atexit
+import smtplib
+from queue import Empty, Queue
+from threading import Lock, Thread
+from time import sleep
 from flask import current_app
 from flask_mail import Message
-from app import mail
-from threading import Thread
 
-def send_async_email(app, msg):
-    with app.app_context():
-        mail.send(msg)
+
+class MailWorker():
+    """Delivers mail in the background with a pool of MAIL_WORKERS
+    threads. Each thread takes up to MAIL_BATCH_SIZE queued messages
+    and sends them over one SMTP connection. The queue holds at most
+    MAIL_QUEUE_SIZE messages, send() waits up to MAIL_ENQUEUE_TIMEOUT
+    seconds for room. Failed deliveries are retried MAIL_RETRIES times
+    with exponential backoff. The queue is drained at shutdown, for at
+    most MAIL_CLOSE_TIMEOUT seconds per thread."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        pool = _MailPool(app)
+        app.extensions['mail_worker'] = pool
+        atexit.register(pool.close)
+
+    @staticmethod
+    def _pool():
+        return current_app.extensions['mail_worker']
+
+    def send(self, message):
+        """Queue message for delivery. Raises queue.Full if the queue
+        stays full for MAIL_ENQUEUE_TIMEOUT seconds."""
+        self._pool().put(message)
+
+    def close(self, timeout=None):
+        """Deliver the queued messages and stop the threads, waiting
+        timeout or MAIL_CLOSE_TIMEOUT seconds for each thread."""
+        self._pool().close(timeout)
+
+    def report(self):
+        """Return the number of queued, sent and failed messages."""
+        pool = self._pool()
+        with pool._lock:
+            return {'queued': pool.queue.qsize(), 'sent': pool.sent,
+                    'failed': pool.failed}
+
+
+class _MailPool():
+    """Queue and delivery threads of one application."""
+    # tells a thread to stop
+    STOP = None
+
+    def __init__(self, app, sleep=sleep):
+        self.app = app
+        self.queue = Queue(app.config['MAIL_QUEUE_SIZE'])
+        self.threads = []
+        self.sent = self.failed = 0
+        self._lock = Lock()
+        self._sleep = sleep
+
+    def put(self, message):
+        self.queue.put(message,
+                       timeout=self.app.config['MAIL_ENQUEUE_TIMEOUT'])
+        with self._lock:
+            if not self.threads:
+                self.threads = [Thread(target=self._run, daemon=True)
+                                for _ in range(self.app.config['MAIL_WORKERS'])]
+                for thread in self.threads:
+                    thread.start()
+
+    def close(self, timeout=None):
+        if timeout is None:
+            timeout = self.app.config['MAIL_CLOSE_TIMEOUT']
+        with self._lock:
+            threads, self.threads = self.threads, []
+        for _ in threads:
+            self.queue.put(self.STOP)
+        for thread in threads:
+            thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            while (batch[-1] is not self.STOP
+                   and len(batch) < self.app.config['MAIL_BATCH_SIZE']):
+                try:
+                    batch.append(self.queue.get_nowait())
+                except Empty:
+                    break
+            stop = batch[-1] is self.STOP
+            if stop:
+                batch.pop()
+            if batch:
+                try:
+                    with self.app.app_context():
+                        self._deliver(batch)
+                except Exception:
+                    # keep the thread alive for the next batches
+                    self._count(failed=len(batch))
+                    self.app.logger.exception('Could not deliver %d messages',
+                                              len(batch))
+            if stop:
+                return
+
+    def _deliver(self, batch):
+        retries = self.app.config['MAIL_RETRIES']
+        for attempt in range(retries + 1):
+            if attempt:
+                self._sleep(self.app.config['MAIL_RETRY_DELAY']
+                            * 2 ** (attempt - 1))
+            try:
+                with self.app.extensions['mail'].connect() as connection:
+                    while batch:
+                        self._send(connection, batch[0])
+                        batch.pop(0)
+                return
+            except (smtplib.SMTPException, OSError):
+                self.app.logger.warning('Could not deliver %d messages',
+                                        len(batch), exc_info=True)
+        self._count(failed=len(batch))
+        self.app.logger.error('Dropped %d messages after %d retries',
+                              len(batch), retries)
+
+    def _send(self, connection, message):
+        try:
+            connection.send(message)
+        except smtplib.SMTPRecipientsRefused:
+            # retrying does not help a refused address
+            self._count(failed=1)
+            self.app.logger.error('Recipients of %r refused', message.subject)
+        except (smtplib.SMTPException, OSError):
+            raise
+        except Exception:
+            # a broken message, e.g. BadHeaderError, fails on every retry
+            self._count(failed=1)
+            self.app.logger.exception('Could not send %r', message.subject)
+        else:
+            self._count(sent=1)
+
+    def _count(self, sent=0, failed=0):
+        with self._lock:
+            self.sent += sent
+            self.failed += failed
+
 
 def send_email(subject, sender, recipients, text_body, html_body):
     msg = Message(subject, sender=sender, recipients=recipients)
     msg.body = text_body
     msg.html = html_body
-    Thread(target=send_async_email, args=(current_app._get_current_object(), msg)).start()
-
+    from app import mail_worker
+    mail_worker.send(msg)
@@ -1,5 +1,191 @@
 """ Defining the Graph class"""
-from copy import deepcopy
+from array import array
+from collections import namedtuple
+
+
+# result of CompactGraph.schedule, all mappings are keyed by vertex
+Schedule = namedtuple('Schedule', ['duration', 'earliest_start',
+                                   'latest_finish', 'slack',
+                                   'critical_path'])
+
+
+class CycleError(ValueError):
+    """ Raised when a graph that has to be acyclic contains a cycle.
+        cycle lists the vertices along the cycle, the last
+        vertex has an edge back to the first one. """
+
+    def __init__(self, cycle):
+        super().__init__("graph contains a cycle: {}".format(cycle))
+        self.cycle = cycle
+
+
+class DisjointSet():
+
+    """ Union find over hashable elements with
+        path compression and union by rank. """
+
+    def __init__(self, elements=()):
+        self.parent = {}
+        self.rank = {}
+        for element in elements:
+            self.add(element)
+
+    def add(self, element):
+        """ adds element as a singleton set """
+        if element not in self.parent:
+            self.parent[element] = element
+            self.rank[element] = 0
+
+    def find(self, element):
+        """ returns the representative of the set of element """
+        self.add(element)
+        root = element
+        while self.parent[root] != root:
+            root = self.parent[root]
+        while self.parent[element] != root:
+            self.parent[element], element = root, self.parent[element]
+        return root
+
+    def union(self, a, b):
+        """ merges the sets of a and b, returns the new representative """
+        a, b = self.find(a), self.find(b)
+        if a == b:
+            return a
+        if self.rank[a] < self.rank[b]:
+            a, b = b, a
+        self.parent[b] = a
+        if self.rank[a] == self.rank[b]:
+            self.rank[a] += 1
+        return a
+
+    def groups(self):
+        """ returns the sets as lists of elements """
+        groups = {}
+        for element in self.parent:
+            groups.setdefault(self.find(element), []).append(element)
+        return list(groups.values())
+
+
+def _reachable(start, neighbours, visited):
+    """ iterative depth first search from start.
+        Marks every reached vertex in visited and returns
+        them in the order they were reached.
+    """
+    reached = []
+    stack = [start]
+    while stack:
+        at = stack.pop()
+        if at in visited:
+            continue
+        visited.add(at)
+        reached.append(at)
+        stack.extend(reversed(neighbours(at)))
+    return reached
+
+
+def _topological_order(vertices, neighbours):
+    """ iterative depth first search over all vertices.
+        Returns the vertices in topological order and
+        raises CycleError if the graph contains a cycle.
+    """
+    ON_STACK, DONE = 1, 2
+    state = {}
+    order = []
+    for root in vertices:
+        if root in state:
+            continue
+        state[root] = ON_STACK
+        stack = [(root, iter(neighbours(root)))]
+        while stack:
+            at, remaining = stack[-1]
+            for next in remaining:
+                if next not in state:
+                    state[next] = ON_STACK
+                    stack.append((next, iter(neighbours(next))))
+                    break
+                if state[next] == ON_STACK:
+                    path = [vertex for vertex, _ in stack]
+                    raise CycleError(path[path.index(next):])
+            else:
+                stack.pop()
+                state[at] = DONE
+                order.append(at)
+    order.reverse()
+    return order
+
+
+def reorder_for_edge(source, sink, key, sinks, sources):
+    """ Incremental topological ordering in the style of Pearce and Kelly.
+        key(v) is the current order key of vertex v, sinks(v) and
+        sources(v) return its neighbours. Before inserting the edge
+        source -> sink, only the vertices with keys between key(sink)
+        and key(source) are searched. Returns a dictionary with the new
+        keys of the vertices that have to move and raises CycleError
+        if sink already reaches source.
+    """
+    lower, upper = key(sink), key(source)
+    if upper < lower:
+        return {}
+
+    # vertices reachable from sink that are not yet behind source
+    parent = {sink: None}
+    stack = [sink]
+    while stack:
+        at = stack.pop()
+        for next in sinks(at):
+            if next == source:
+                cycle = [at]
+                while parent[cycle[-1]] is not None:
+                    cycle.append(parent[cycle[-1]])
+                cycle.reverse()
+                raise CycleError(cycle + [source])
+            if next not in parent and key(next) <= upper:
+                parent[next] = at
+                stack.append(next)
+    forward = list(parent)
+
+    # vertices reaching source that are not yet ahead of sink
+    visited = {source}
+    stack = [source]
+    while stack:
+        at = stack.pop()
+        for next in sources(at):
+            if next not in visited and key(next) >= lower:
+                visited.add(next)
+                stack.append(next)
+    backward = list(visited)
+
+    return reassign_keys(backward, forward, key)
+
+
+def reassign_keys(backward, forward, key):
+    """ Second phase of the Pearce-Kelly reordering. The keys of all
+        affected vertices are pooled, the vertices reaching the source
+        take the smallest ones, the vertices reachable from the sink the
+        rest, both keeping their relative order. Returns a dictionary
+        with the new keys of the vertices that move.
+    """
+    keys = sorted(key(v) for v in backward + forward)
+    moved = sorted(backward, key=key) + sorted(forward, key=key)
+    return {v: k for v, k in zip(moved, keys) if key(v) != k}
+
+
+def _csr(size, sources, sinks):
+    """ builds the offset and target buffers of a
+        compressed sparse row adjacency from two
+        parallel arrays of vertex indices
+    """
+    offsets = array('l', [0]) * (size + 1)
+    for source in sources:
+        offsets[source + 1] += 1
+    for i in range(size):
+        offsets[i + 1] += offsets[i]
+    targets = array('l', [0]) * len(sinks)
+    fill = offsets[:-1]
+    for source, sink in zip(sources, sinks):
+        targets[fill[source]] = sink
+        fill[source] += 1
+    return offsets, targets
 
 
 class Graph():
@@ -8,107 +194,379 @@ class Graph():
     https://www.python-course.eu/graphs_python.php """
 
     def __init__(self, graph_dict=None):
-        """ initializes a graph object """
+        """ initializes a graph object from a dictionary
+            mapping every vertex to a list of its sinks """
+        # dicts are used as insertion ordered sets
+        self.__sinks = {}
+        self.__sources = {}
         if graph_dict is None:
             graph_dict = {}
-        self.__graph_dict = graph_dict
+        for vertex in graph_dict:
+            self.add_node(vertex)
+            for sink in graph_dict[vertex]:
+                self.add_edge([vertex, sink])
 
     def nodes(self):
         """ returns node of a graph """
-        return list(self.__graph_dict.keys())
-
-    def __generate_edges(self):
-        """ A static method generating the edges of the
-            graph "graph". Edges are represented as sets
-            with one (a loop back to the vertex) or two
-            vertices
-        """
-        edges = []
-        for vertex in self.__graph_dict:
-            for sink in self.__graph_dict[vertex]:
-                if [vertex, sink] not in edges:
-                    edges.append([vertex, sink])
-        return edges
+        return list(self.__sinks)
 
     def edges(self):
         """ returns the edges of a graph """
-        return self.__generate_edges()
+        return [[vertex, sink]
+                for vertex in self.__sinks
+                for sink in self.__sinks[vertex]]
+
+    def add_node(self, node):
+        if node not in self.__sinks:
+            self.__sinks[node] = {}
+            self.__sources[node] = {}
+
+    def has_edge(self, edge):
+        [source, sink] = edge
+        return sink in self.__sinks.get(source, ())
 
     def add_edge(self, edge):
         [source, sink] = edge
-        if edge in self.edges():
-            return
-        if source in self.__graph_dict:
-            self.__graph_dict[source].append(sink)
-        else:
-            self.__graph_dict[source] = [sink]
+        self.add_node(source)
+        self.add_node(sink)
+        self.__sinks[source][sink] = None
+        self.__sources[sink][source] = None
+
+    def remove_edge(self, edge):
+        [source, sink] = edge
+        if self.has_edge(edge):
+            del self.__sinks[source][sink]
+            del self.__sources[sink][source]
+
+    def sinks(self, node):
+        """ returns the sinks of node """
+        return list(self.__sinks.get(node, ()))
+
+    def sources(self, node):
+        """ returns the sources of node """
+        return list(self.__sources.get(node, ()))
+
+    def neighbours(self, node):
+        """ returns the sinks and sources of node """
+        sinks = self.__sinks.get(node, ())
+        return list(sinks) + [source for source in self.sources(node)
+                              if source not in sinks]
 
     def undirected(self):
-        undirected_graph = deepcopy(self)
-        for edge in undirected_graph.edges():
-            [source, sink] = edge
-            reverse_edge = [sink, source]
-            undirected_graph.add_edge(reverse_edge)
-        return undirected_graph
+        """ returns an undirected view of the graph, nothing is copied """
+        return UndirectedView(self)
 
     def depth_first_search(self, start_node, direction="forward"):
         if direction == "undirected":
-            graph = self.undirected()
+            neighbours = self.neighbours
         elif direction == "forward":
-            graph = self
-        visited = []
-
-        def dfs(at):
-            if at in visited:
-                return
-            visited.append(at)
-            neighbours = graph.__graph_dict[at]
-            for next in neighbours:
-                dfs(next)
-        dfs(start_node)
-        return visited
+            neighbours = self.sinks
+        elif direction == "backward":
+            neighbours = self.sources
+        return _reachable(start_node, neighbours, set())
 
     def connected_components(self):
         components = []
-        visited = []
+        visited = set()
         for node in self.nodes():
             if node in visited:
                 continue
-            component = self.depth_first_search(start_node=node,
-                                                direction="undirected")
-            components.append(component)
-            visited += component
+            components.append(_reachable(node, self.neighbours, visited))
         return components
 
+    def weak_components(self):
+        """ returns the weakly connected components of the graph """
+        components = DisjointSet(self.nodes())
+        for source in self.__sinks:
+            for sink in self.__sinks[source]:
+                components.union(source, sink)
+        return components.groups()
+
     def topsort(self):
-        visited = []
-        order = []
-        nodes = self.nodes()
+        """ returns the nodes in topological order.
+            Raises CycleError if the graph contains a cycle. """
+        return _topological_order(self.nodes(), self.sinks)
 
-        def dfs(node):
-            if node in visited:
-                return
-            visited.append(node)
-            neighbours = self.__graph_dict[node]
-            for next in neighbours:
-                dfs(next)
-            order.append(node)
+    def snapshot(self):
+        """ returns a read-only CompactGraph of the graph """
+        return CompactGraph.from_dict(self.__sinks)
+
+    def schedule(self, durations=None):
+        """ critical path schedule of the graph, see CompactGraph """
+        return self.snapshot().schedule(durations)
+
+    def redundant_edges(self):
+        """ edges implied by other paths, see CompactGraph """
+        return self.snapshot().redundant_edges()
+
+    def transitive_reduction(self):
+        """ returns a Graph without the redundant edges """
+        reduction = self.snapshot().transitive_reduction()
+        return Graph({node: reduction.sinks(node)
+                      for node in reduction.nodes()})
 
+
+class UndirectedView():
+
+    """ A read-only view of a Graph that follows
+        every edge in both directions. """
+
+    def __init__(self, graph):
+        self._graph = graph
+
+    def nodes(self):
+        """ returns node of a graph """
+        return self._graph.nodes()
+
+    def edges(self):
+        """ returns the edges of a graph in both directions """
+        edges = self._graph.edges()
+        return edges + [[sink, source] for [source, sink] in edges
+                        if not self._graph.has_edge([sink, source])]
+
+    def has_edge(self, edge):
+        [source, sink] = edge
+        return (self._graph.has_edge(edge)
+                or self._graph.has_edge([sink, source]))
+
+    def sinks(self, node):
+        """ returns the neighbours of node """
+        return self._graph.neighbours(node)
+
+    def depth_first_search(self, start_node):
+        return _reachable(start_node, self.sinks, set())
+
+    def connected_components(self):
+        return self._graph.connected_components()
+
+
+class CompactGraph():
+
+    """ A read-only graph in compressed sparse row form.
+        Vertices are mapped to dense integers, the sinks of
+        vertex i are targets[offsets[i]:offsets[i + 1]] and
+        its sources rtargets[roffsets[i]:roffsets[i + 1]].
+        Only the vertex labels (e.g. node ids) are kept
+        as python objects. """
+
+    def __init__(self, nodes=(), edges=()):
+        """ nodes is an iterable of vertex labels,
+            edges an iterable of (source, sink) label pairs.
+            Labels only appearing in edges are added as vertices.
+        """
+        self.labels = []
+        self.index = {}
         for node in nodes:
-            if node in visited:
+            self.__vertex(node)
+        sources = array('l')
+        sinks = array('l')
+        for source, sink in edges:
+            sources.append(self.__vertex(source))
+            sinks.append(self.__vertex(sink))
+        size = len(self.labels)
+        self.offsets, self.targets = _csr(size, sources, sinks)
+        self.roffsets, self.rtargets = _csr(size, sinks, sources)
+        self._closure = None
+
+    @classmethod
+    def from_dict(cls, graph_dict):
+        """ builds a snapshot from a dictionary mapping
+            every vertex to a list of its sinks """
+        edges = ((source, sink)
+                 for source in graph_dict
+                 for sink in dict.fromkeys(graph_dict[source]))
+        return cls(graph_dict, edges)
+
+    def __vertex(self, label):
+        if label not in self.index:
+            self.index[label] = len(self.labels)
+            self.labels.append(label)
+        return self.index[label]
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _sinks(self, i):
+        return self.targets[self.offsets[i]:self.offsets[i + 1]]
+
+    def _sources(self, i):
+        return self.rtargets[self.roffsets[i]:self.roffsets[i + 1]]
+
+    def _neighbours(self, i):
+        return self._sinks(i) + self._sources(i)
+
+    def nodes(self):
+        """ returns node of a graph """
+        return list(self.labels)
+
+    def edges(self):
+        """ returns the edges of a graph """
+        labels = self.labels
+        return [[labels[source], labels[sink]]
+                for source in range(len(labels))
+                for sink in self._sinks(source)]
+
+    def sinks(self, node):
+        """ returns the sinks of node """
+        return [self.labels[i] for i in self._sinks(self.index[node])]
+
+    def sources(self, node):
+        """ returns the sources of node """
+        return [self.labels[i] for i in self._sources(self.index[node])]
+
+    def depth_first_search(self, start_node, direction="forward"):
+        if direction == "undirected":
+            neighbours = self._neighbours
+        elif direction == "forward":
+            neighbours = self._sinks
+        elif direction == "backward":
+            neighbours = self._sources
+        reached = _reachable(self.index[start_node], neighbours, set())
+        return [self.labels[i] for i in reached]
+
+    def connected_components(self):
+        components = []
+        visited = set()
+        for i in range(len(self.labels)):
+            if i in visited:
                 continue
-            dfs(node)
+            component = _reachable(i, self._neighbours, visited)
+            components.append([self.labels[j] for j in component])
+        return components
 
-        order.reverse()
+    weak_components = connected_components
 
-        # test ordering
-        edges = self.edges()
-        for edge in edges:
-            [source, sink] = edge
-            if order.index(source) > order.index(sink):
-                return
+    def closure(self):
+        """ returns the transitive closure as one int bitset per vertex
+            index, bit j of closure()[i] is set if j is reachable from i.
+            Computed once in reverse topological order. Raises CycleError
+            if the graph contains a cycle. """
+        if self._closure is None:
+            reach = [0] * len(self.labels)
+            for level in reversed(self._levels()):
+                for at in level:
+                    bits = 0
+                    for next in self._sinks(at):
+                        bits |= reach[next] | (1 << next)
+                    reach[at] = bits
+            self._closure = reach
+        return self._closure
 
-        return order
+    def reaches(self, source, sink):
+        """ checks if there is a path from source to sink """
+        bits = self.closure()[self.index[source]]
+        return bool(bits >> self.index[sink] & 1)
+
+    def redundant_edges(self):
+        """ returns the edges [source, sink] that are implied by other
+            paths, e.g. a -> c if there are a -> b and b -> c """
+        reach = self.closure()
+        labels = self.labels
+        redundant = []
+        for at in range(len(labels)):
+            covered = 0
+            for next in self._sinks(at):
+                covered |= reach[next]
+            for next in self._sinks(at):
+                if covered >> next & 1:
+                    redundant.append([labels[at], labels[next]])
+        return redundant
+
+    def transitive_reduction(self):
+        """ returns a CompactGraph with the same vertices and
+            reachability but without redundant edges """
+        redundant = {tuple(edge) for edge in self.redundant_edges()}
+        edges = (edge for edge in self.edges()
+                 if tuple(edge) not in redundant)
+        return CompactGraph(self.labels, edges)
+
+    def _levels(self):
+        """ returns the vertex indices grouped by level. Level 0 holds
+            the vertices without sources, every other vertex sits one
+            level after its latest source. Raises CycleError if the
+            graph contains a cycle. """
+        size = len(self.labels)
+        indegree = array('l', (self.roffsets[i + 1] - self.roffsets[i]
+                               for i in range(size)))
+        levels = []
+        level = [i for i in range(size) if indegree[i] == 0]
+        placed = 0
+        while level:
+            levels.append(level)
+            placed += len(level)
+            next_level = []
+            for at in level:
+                for next in self._sinks(at):
+                    indegree[next] -= 1
+                    if indegree[next] == 0:
+                        next_level.append(next)
+            level = next_level
+        if placed < size:
+            self.topsort()
+        return levels
+
+    def schedule(self, durations=None):
+        """ Critical path method. durations maps vertices to their
+            duration, missing vertices take 1. The forward pass computes
+            the earliest start of every vertex level by level, the
+            backward pass the latest finish that does not delay the
+            whole graph. Vertices without slack form the critical path.
+            Raises CycleError if the graph contains a cycle. """
+        size = len(self.labels)
+        levels = self._levels()
+        if durations is None:
+            duration = array('d', [1.0]) * size
+        else:
+            duration = array('d', (durations.get(label, 1)
+                                   for label in self.labels))
+
+        start = array('d', [0.0]) * size
+        for level in levels:
+            for at in level:
+                finish = start[at] + duration[at]
+                for next in self._sinks(at):
+                    if finish > start[next]:
+                        start[next] = finish
+        end = max((start[i] + duration[i] for i in range(size)), default=0.0)
+
+        latest = array('d', [end]) * size
+        for level in reversed(levels):
+            for at in level:
+                for next in self._sinks(at):
+                    begin = latest[next] - duration[next]
+                    if begin < latest[at]:
+                        latest[at] = begin
+        slack = array('d', (latest[i] - duration[i] - start[i]
+                            for i in range(size)))
+
+        path = []
+        candidates = levels[0] if levels else []
+        while True:
+            critical = [i for i in candidates if abs(slack[i]) < 1e-9]
+            if not critical:
+                break
+            at = critical[0]
+            path.append(at)
+            finish = start[at] + duration[at]
+            candidates = [i for i in self._sinks(at)
+                          if abs(start[i] - finish) < 1e-9]
+
+        labels = self.labels
+        return Schedule(
+            duration=end,
+            earliest_start=dict(zip(labels, start)),
+            latest_finish=dict(zip(labels, latest)),
+            slack=dict(zip(labels, slack)),
+            critical_path=[labels[i] for i in path])
+
+    def topsort(self):
+        """ returns the nodes in topological order.
+            Raises CycleError if the graph contains a cycle. """
+        try:
+            order = _topological_order(range(len(self.labels)), self._sinks)
+        except CycleError as error:
+            raise CycleError([self.labels[i] for i in error.cycle]) from None
+        return [self.labels[i] for i in order]
 
 
 if __name__ == "__main__":
@@ -125,3 +583,4 @@ if __name__ == "__main__":
     print(graph.edges())
     print(graph.connected_components())
     print(graph.topsort())
+    print(graph.snapshot().topsort())
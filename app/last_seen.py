@@ -0,0 +1,113 @@
+"""Write-behind updates of User.last_seen."""
+import atexit
+from datetime import datetime
+from threading import Lock, Thread
+from time import monotonic, sleep
+from weakref import WeakSet
+
+# the states of all applications, written by one exit handler
+_states = WeakSet()
+
+
+@atexit.register
+def _flush_all():
+    for state in list(_states):
+        state.flush_at_exit()
+
+
+class LastSeen():
+    """Collects the last seen timestamps of users in memory and writes
+    them with one batched UPDATE when LAST_SEEN_FLUSH_SIZE users are
+    pending or LAST_SEEN_FLUSH_INTERVAL seconds have passed. A daemon
+    thread bounds the staleness when there is no traffic, pending
+    timestamps are written at shutdown. A failed write is logged and
+    its timestamps are kept for the next one."""
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        state = _LastSeenState(app)
+        app.extensions['last_seen'] = state
+        _states.add(state)
+
+    @staticmethod
+    def _state():
+        from flask import current_app
+        return current_app.extensions['last_seen']
+
+    def record(self, user_id, when=None):
+        """Remember that user_id was seen now (or at when)."""
+        self._state().record(user_id, when or datetime.utcnow())
+
+    def flush(self):
+        """Write all pending timestamps."""
+        self._state().flush()
+
+    def pending(self):
+        """Return the pending timestamps by user id."""
+        return dict(self._state().pending)
+
+
+class _LastSeenState():
+    """Pending timestamps of one application."""
+
+    def __init__(self, app):
+        self.app = app
+        self.pending = {}
+        self.lock = Lock()
+        self.last_flush = monotonic()
+        self.flusher = None
+
+    def record(self, user_id, when):
+        interval = self.app.config['LAST_SEEN_FLUSH_INTERVAL']
+        with self.lock:
+            self.pending[user_id] = when
+            due = (len(self.pending) >= self.app.config['LAST_SEEN_FLUSH_SIZE']
+                   or monotonic() - self.last_flush >= interval)
+            if self.flusher is None and not due:
+                self.flusher = Thread(target=self._flush_periodically,
+                                      args=(interval,), daemon=True)
+                self.flusher.start()
+        if due:
+            self.try_flush()
+
+    def flush(self):
+        from app import db
+        from app.models import User
+        with self.lock:
+            pending, self.pending = self.pending, {}
+            self.last_flush = monotonic()
+        if not pending:
+            return
+        update = (User.__table__.update()
+                  .where(User.id == db.bindparam('user_id'))
+                  .values(last_seen=db.bindparam('seen')))
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(update, [
+                    {'user_id': user_id, 'seen': seen}
+                    for user_id, seen in pending.items()])
+        except Exception:
+            with self.lock:
+                # times recorded in the meantime are newer
+                for user_id, seen in pending.items():
+                    self.pending.setdefault(user_id, seen)
+            raise
+
+    def _flush_periodically(self, interval):
+        while True:
+            sleep(interval)
+            self.flush_at_exit()
+
+    def flush_at_exit(self):
+        with self.app.app_context():
+            self.try_flush()
+
+    def try_flush(self):
+        """Write the pending timestamps, log instead of raising."""
+        try:
+            self.flush()
+        except Exception:
+            self.app.logger.exception('Could not write last seen times')
@@ -31,6 +31,9 @@ class EditProjectForm(FlaskForm):
     name = StringField('New Project Name')
     submit = SubmitField('Submit')
 
+class RedundantEdgesForm(FlaskForm):
+    submit = SubmitField('Remove redundant dependencies')
+
 class NodeForm(FlaskForm):
     input_format = '%Y-%m-%dT%H:%M'
     name = StringField('New Node', validators=[DataRequired()])
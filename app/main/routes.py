@@ -1,4 +1,4 @@
-from datetime import datetime
+import io
 from flask import (
     render_template,
     flash,
@@ -6,13 +6,29 @@ from flask import (
     url_for,
     request,
     current_app,
-    g
+    g,
+    jsonify,
+    abort,
+    Response,
+    stream_with_context
 )
 from flask_login import current_user, login_required
 from wtforms.fields import Label
 from app.models import User, Project, Node
-from app import db
-from app.main.forms import EditProfileForm, ProjectForm, SearchForm, NodeForm
+from app.graphs import CycleError
+from app.conditional import add_validators, invalidate_pages, not_modified
+from app.pagination import keyset_paginate
+from app.replica import read_only
+from app.transfer import (FORMATS, MIMETYPES, export_records,
+                          import_records, read_records, write_records)
+from app import db, last_seen
+from app.main.forms import (
+    EditProfileForm,
+    ProjectForm,
+    SearchForm,
+    NodeForm,
+    RedundantEdgesForm
+)
 from app.main import bp
 
 
@@ -20,11 +36,28 @@ from app.main import bp
 def before_request():
     """ Load g if current user is authenticated."""
     if current_user.is_authenticated:
-        current_user.last_seen = datetime.utcnow()
-        db.session.commit()
+        last_seen.record(current_user.id)
         g.search_form = SearchForm()
 
 
+@bp.after_request
+def after_request(response):
+    """Add the validators of conditional GET pages."""
+    return add_validators(response)
+
+
+def _project_page(query):
+    """Return the page of query selected by the after or before cursor,
+    newest projects first."""
+    try:
+        return keyset_paginate(query, Project.timestamp, Project.id,
+                               current_app.config['PROJECTS_PER_PAGE'],
+                               after=request.args.get('after'),
+                               before=request.args.get('before'))
+    except ValueError:
+        abort(400)
+
+
 @bp.route('/', methods=['GET', 'POST'])
 @bp.route('/index', methods=['GET', 'POST'])
 @login_required
@@ -37,16 +70,12 @@ def index():
         db.session.commit()
         flash('Added a new project.')
         return redirect(url_for('main.index'))
-    page = request.args.get('page', 1, type=int)
-    projects = (
-        Project.query.filter_by(created_by=current_user)
-        .order_by(Project.timestamp.desc())
-        .paginate(page, current_app.config['PROJECTS_PER_PAGE'], False)
-        )
-    next_url = url_for('main.index', page=projects.next_num) \
-        if projects.has_next else None
-    prev_url = url_for('main.index', page=projects.prev_num) \
-        if projects.has_prev else None
+    projects = _project_page(
+        Project.query.filter_by(created_by=current_user))
+    next_url = url_for('main.index', after=projects.next_cursor) \
+        if projects.next_cursor else None
+    prev_url = url_for('main.index', before=projects.prev_cursor) \
+        if projects.prev_cursor else None
     return render_template('index.html', title='Home',
                            form=form, projects=projects.items,
                            next_url=next_url, prev_url=prev_url)
@@ -54,17 +83,13 @@ def index():
 
 @bp.route('/explore')
 @login_required
+@read_only
 def explore():
-    page = request.args.get('page', 1, type=int)
-    projects = (
-        Project.query.order_by(Project.timestamp.desc())
-        .paginate(page, current_app.config['PROJECTS_PER_PAGE'], False)
-        )
-
-    next_url = url_for('main.explore', page=projects.next_num) \
-        if projects.has_next else None
-    prev_url = url_for('main.explore', page=projects.prev_num) \
-        if projects.has_prev else None
+    projects = _project_page(Project.query)
+    next_url = url_for('main.explore', after=projects.next_cursor) \
+        if projects.next_cursor else None
+    prev_url = url_for('main.explore', before=projects.prev_cursor) \
+        if projects.prev_cursor else None
     return render_template('index.html', title='Explore',
                            projects=projects.items,
                            next_url=next_url, prev_url=prev_url)
@@ -72,20 +97,16 @@ def explore():
 
 @bp.route('/user/<username>')
 @login_required
+@read_only
 def user(username):
     user = User.query.filter_by(username=username).first_or_404()
-    page = request.args.get('page', 1, type=int)
-    projects = (
-        Project.query.filter_by(created_by=user)
-        .order_by(Project.timestamp.desc())
-        .paginate(page, current_app.config['PROJECTS_PER_PAGE'], False)
-        )
+    projects = _project_page(Project.query.filter_by(created_by=user))
     next_url = url_for('main.user', username=user.username,
-                       page=projects.next_num) \
-        if projects.has_next else None
+                       after=projects.next_cursor) \
+        if projects.next_cursor else None
     prev_url = url_for('main.user', username=user.username,
-                       page=projects.prev_num) \
-        if projects.has_prev else None
+                       before=projects.prev_cursor) \
+        if projects.prev_cursor else None
     return render_template('user.html', user=user, title=user.username,
                            projects=projects.items, next_url=next_url,
                            prev_url=prev_url)
@@ -99,6 +120,8 @@ def edit_profile():
         current_user.username = form.username.data
         current_user.about_me = form.about_me.data
         db.session.commit()
+        current_user.uncache()
+        invalidate_pages()
         flash('Your changes have been saved.')
         return redirect(url_for('main.edit_profile'))
     elif request.method == 'GET':
@@ -110,6 +133,7 @@ def edit_profile():
 
 @bp.route('/search')
 @login_required
+@read_only
 def search():
     if not g.search_form.validate():
         return redirect(url_for('main.explore'))
@@ -127,6 +151,7 @@ def search():
 
 @bp.route('/project/<projectid>', methods=['GET', 'POST'])
 @login_required
+@read_only
 def project(projectid):
     project = Project.query.filter_by(id=projectid).first_or_404()
     nodeform = NodeForm()
@@ -137,8 +162,10 @@ def project(projectid):
         db.session.commit()
         flash('Added new task.')
         return redirect(url_for('main.project', projectid=project.id))
-
-    nodes = Node.query.filter_by(project=project).all()
+    response = not_modified(project)
+    if response is not None:
+        return response
+    nodes = Project.load_nodes(project.id)
     return render_template('project.html', project=project,
                            nodeform=nodeform, nodes=nodes, title=project.name)
 
@@ -163,16 +190,126 @@ def edit_project(projectid):
 
 @bp.route('/project/<projectid>/analyze', methods=['GET', 'POST'])
 @login_required
+@read_only
 def analyze_project(projectid):
     project = Project.query.filter_by(id=projectid).first_or_404()
-    graph = project.graph()
+    form = RedundantEdgesForm()
+    if form.validate_on_submit():
+        removed = project.remove_redundant_edges()
+        db.session.commit()
+        flash('Removed {} redundant dependencies.'.format(removed))
+        return redirect(url_for('main.analyze_project',
+                                projectid=project.id))
+    response = not_modified(project)
+    if response is not None:
+        return response
     analysis = {}
+    results = project.analysis()
+    nodes = {node.id: node for node in Project.load_nodes(project.id)}
     # Weak Components
-    weak_components = graph.weak_components()
+    weak_components = results['weak_components']
     if len(weak_components) > 1:
+        weak_components = [[nodes[i] for i in component]
+                           for component in weak_components]
         analysis["weak_components"] = sorted(weak_components, key=len)
+    # Critical Path
+    schedule = results['schedule']
+    if schedule and schedule.critical_path:
+        analysis["duration"] = schedule.duration
+        analysis["critical_path"] = [nodes[i] for i in
+                                     schedule.critical_path if i in nodes]
+    # Redundant Edges
+    if results['redundant_edges'] is None:
+        analysis["redundant_edges_skipped"] = True
+    redundant_edges = [(nodes[source], nodes[sink])
+                       for source, sink in results['redundant_edges'] or []
+                       if source in nodes and sink in nodes]
+    if redundant_edges:
+        analysis["redundant_edges"] = redundant_edges
     return render_template('analyze_project.html', project=project,
-                           title=project.name, analysis=analysis)
+                           title=project.name, analysis=analysis,
+                           form=form)
+
+
+@bp.route('/project/<projectid>/edges', methods=['POST'])
+@login_required
+def project_edges(projectid):
+    """Apply a list of edge operations in one transaction. Expects
+    {"operations": [{"op": "connect" or "disconnect",
+    "source": <node id>, "sink": <node id>}, ...]}.
+    All disconnects are applied before the connects."""
+    project = Project.query.filter_by(id=projectid).first_or_404()
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify(error='Expected a JSON object'), 400
+    connect, disconnect = [], []
+    try:
+        for operation in data.get('operations', []):
+            pair = (int(operation['source']), int(operation['sink']))
+            if operation['op'] == 'connect':
+                connect.append(pair)
+            elif operation['op'] == 'disconnect':
+                disconnect.append(pair)
+            else:
+                raise ValueError('Unknown operation {}'
+                                 .format(operation['op']))
+        disconnected = project.disconnect_many(disconnect)
+        connected = project.connect_many(connect)
+    except CycleError as error:
+        db.session.rollback()
+        return jsonify(error='Connections would create a cycle',
+                       cycle=error.cycle), 409
+    except (KeyError, TypeError, ValueError) as error:
+        db.session.rollback()
+        return jsonify(error=str(error)), 400
+    db.session.commit()
+    return jsonify(connected=connected, disconnected=disconnected,
+                   revision=project.revision)
+
+
+@bp.route('/project/<projectid>/export')
+@login_required
+@read_only
+def export_project(projectid):
+    """Stream the graph of a project as JSON Lines or CSV."""
+    project = Project.query.filter_by(id=projectid).first_or_404()
+    format = request.args.get('format', 'jsonl')
+    if format not in FORMATS:
+        abort(400)
+    chunk_size = current_app.config['TRANSFER_CHUNK_SIZE']
+    lines = write_records(export_records(project, chunk_size), format)
+    return Response(stream_with_context(lines), mimetype=MIMETYPES[format],
+                    headers={'Content-Disposition':
+                             'attachment; filename=project-{}.{}'
+                             .format(project.id, format)})
+
+
+@bp.route('/project/<projectid>/import', methods=['POST'])
+@login_required
+def import_project(projectid):
+    """Add the nodes and edges of a JSON Lines or CSV request body
+    to a project, reading the body as a stream. Other content types are
+    refused: a cross-site form can post text/plain but none of these."""
+    project = Project.query.filter_by(id=projectid).first_or_404()
+    if request.mimetype not in {*MIMETYPES.values(), 'application/json'}:
+        return jsonify(error='Unsupported content type {}'
+                       .format(request.mimetype)), 415
+    format = request.args.get(
+        'format', 'csv' if request.mimetype == MIMETYPES['csv'] else 'jsonl')
+    lines = io.TextIOWrapper(request.stream, encoding='utf-8', newline='')
+    try:
+        nodes, edges = import_records(
+            project, read_records(lines, format), creator=current_user,
+            chunk_size=current_app.config['TRANSFER_CHUNK_SIZE'])
+    except CycleError as error:
+        db.session.rollback()
+        return jsonify(error='Edges would create a cycle',
+                       cycle=error.cycle), 409
+    except ValueError as error:
+        db.session.rollback()
+        return jsonify(error=str(error)), 400
+    db.session.commit()
+    return jsonify(nodes=nodes, edges=edges, revision=project.revision)
 
 
 @bp.route('/node/<nodeid>', methods=['GET', 'POST'])
@@ -188,11 +325,16 @@ def node(nodeid):
             db.session.commit()
             flash('Removed existing node as source')
         elif Node.query.filter_by(id=form.name.data).count() == 1:
-            current_node.add_source(
-                Node.query.filter_by(id=form.name.data).first()
-            )
-            db.session.commit()
-            flash('Added existing node as source')
+            try:
+                current_node.add_source(
+                    Node.query.filter_by(id=form.name.data).first()
+                )
+            except CycleError:
+                flash('Node depends on this node already, '
+                      'connecting them would create a cycle')
+            else:
+                db.session.commit()
+                flash('Added existing node as source')
         else:
             project = current_node.project
             node = Node(name=form.name.data, project=project,
@@ -202,8 +344,11 @@ def node(nodeid):
             db.session.commit()
             flash('Added new node as source')
         return redirect(url_for('main.node', nodeid=current_node.id))
-    return render_template('node.html', node=current_node, form=form,
-                           title=current_node.name)
+    # no conditional GET, the neighbours can belong to other projects
+    page = Node.load_page(current_node.id)
+    return render_template('node.html', node=page.node, form=form,
+                           sources=page.sources, sinks=page.sinks,
+                           title=page.node.name)
 
 
 @bp.route('/node/<nodeid>/edit', methods=['GET', 'POST'])
@@ -3,6 +3,10 @@ Also used for table creation."""
 
 from flask import current_app
 from app import db
+from sqlalchemy.ext.hybrid import hybrid_property
+from sqlalchemy.orm import make_transient_to_detached
+from itertools import chain
+from collections import namedtuple
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
@@ -10,68 +14,107 @@ from app import login
 from hashlib import md5
 from time import time
 import jwt
-# from app.search import add_to_index, remove_from_index, query_index
+from app.search import create_tables, drop_tables
 from uuid import uuid4
-from app.graphs import Graph
-
-
-# class SearchableMixin():
-#     """MixinClass to enable Search function.
-#     Currently setup for elastic search."""
-#     @classmethod
-#     def search(cls, expression, page, per_page):
-#         """From Flask Guide."""
-#         ids, total = query_index(cls.__tablename__,
-#                                  expression, page, per_page)
-#         if total == 0:
-#             return cls.query.filter_by(id=0), 0
-#         when = []
-#         for i in range(len(ids)):
-#             when.append((ids[i], i))
-#         return cls.query.filter(cls.id.in_(ids)).order_by(
-#             db.case(when, value=cls.id)), total
-#
-#     @classmethod
-#     def before_commit(cls, session):
-#         """From Flask Guide."""
-#         session._changes = {
-#             'add': list(session.new),
-#             'update': list(session.dirty),
-#             'delete': list(session.deleted)
-#         }
-#
-#     @classmethod
-#     def after_commit(cls, session):
-#         """From Flask Guide."""
-#         for obj in session._changes['add']:
-#             if isinstance(obj, SearchableMixin):
-#                 add_to_index(obj.__tablename__, obj)
-#         for obj in session._changes['update']:
-#             if isinstance(obj, SearchableMixin):
-#                 add_to_index(obj.__tablename__, obj)
-#         for obj in session._changes['delete']:
-#             if isinstance(obj, SearchableMixin):
-#                 remove_from_index(obj.__tablename__, obj)
-#         session._changes = None
-#
-#     @classmethod
-#     def reindex(cls):
-#         """From Flask Guide."""
-#         for obj in cls.query:
-#             add_to_index(cls.__tablename__, obj)
-#
-# db.event.listen(db.session, 'before_commit', SearchableMixin.before_commit)
-# db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+from app.graphs import (Graph, CompactGraph, CycleError, DisjointSet,
+                        reassign_keys, reorder_for_edge)
+
+
+def _batches(ids, size=500):
+    """Split ids into lists of at most size elements, to keep IN
+    clauses below the bound parameter limit of the database."""
+    for i in range(0, len(ids), size):
+        yield ids[i:i + size]
+
+
+class SearchableMixin():
+    """Mixin for models kept in the search index of current_app.search,
+    see app/search.py."""
+    @classmethod
+    def search(cls, expression, page, per_page):
+        """Return a page of the objects matching expression, best
+        matches first, and the total number of matches."""
+        ids, total = current_app.search.query(
+            db.session, cls.__tablename__, expression, page, per_page)
+        if total == 0:
+            return cls.query.filter_by(id=0), 0
+        when = []
+        for i in range(len(ids)):
+            when.append((ids[i], i))
+        return cls.query.filter(cls.id.in_(ids)).order_by(
+            db.case(when, value=cls.id)), total
+
+    def _search_changed(self):
+        """Whether a flush changed what the index holds for self."""
+        attrs = db.inspect(self).attrs
+        return any(attrs[key].history.has_changes()
+                   for key in self.__searchable__ + ['project_id']
+                   if key in attrs)
+
+    @classmethod
+    def update_index(cls, session, added=(), removed=()):
+        """Update the index for objects added or changed and removed
+        in session. Transactional backends write right away, the others
+        once the session commits."""
+        search = current_app.search
+        if search.transactional:
+            search.remove(session, removed)
+            search.add(session, added)
+        else:
+            session.info.setdefault('search', []).extend(
+                search.actions(added, removed))
+
+    @classmethod
+    def remove_ids(cls, session, ids):
+        """Remove the objects with ids, deleted with a bulk statement
+        that fires no flush events, from the index."""
+        search = current_app.search
+        if search.transactional:
+            search.remove_ids(session, cls.__tablename__, ids)
+        else:
+            session.info.setdefault('search', []).extend(
+                search.delete_actions(cls.__tablename__, ids))
+
+    @classmethod
+    def after_flush(cls, session, flush_context):
+        added = [obj for obj in session.new
+                 if isinstance(obj, SearchableMixin)]
+        added += [obj for obj in session.dirty
+                  if isinstance(obj, SearchableMixin)
+                  and obj._search_changed()]
+        removed = [obj for obj in session.deleted
+                   if isinstance(obj, SearchableMixin)]
+        if added or removed:
+            cls.update_index(session, added, removed)
+
+    @classmethod
+    def after_commit(cls, session):
+        actions = session.info.pop('search', None)
+        if actions:
+            current_app.search.submit(actions)
+
+    @classmethod
+    def after_rollback(cls, session):
+        session.info.pop('search', None)
 
 
 @login.user_loader
 def load_user(user_id):
-    """Load current user."""
-    return User.query.get(int(user_id))
+    """Load current user, from the user cache when possible."""
+    columns = current_app.user_cache.get(int(user_id))
+    if columns is not None:
+        return User.from_cache(columns)
+    user = User.query.get(int(user_id))
+    if user is not None:
+        current_app.user_cache.set(user.id, user.cache_columns())
+    return user
 
 
 class User(UserMixin, db.Model):
     """ This class describes the user """
+    # the columns load_user keeps in the user cache
+    __cached__ = ['id', 'username', 'first_name', 'last_name', 'email',
+                  'about_me']
     id = db.Column(db.Integer, primary_key=True)
     first_name = db.Column(db.String(64))
     last_name = db.Column(db.String(64))
@@ -88,6 +131,25 @@ class User(UserMixin, db.Model):
     def __repr__(self):
         return '<User {}>'.format(self.username)
 
+    def cache_columns(self):
+        """Return the column values kept in the user cache. The other
+        columns, e.g. password_hash, are loaded on access."""
+        return {key: getattr(self, key) for key in self.__cached__}
+
+    @staticmethod
+    def from_cache(columns):
+        """Attach a user rebuilt from cached columns to the session
+        without querying the database."""
+        user = User(**columns)
+        make_transient_to_detached(user)
+        return db.session.merge(user, load=False)
+
+    def uncache(self):
+        """Drop the cached copy of the user after a change. Only the
+        cache of this process is cleared, the other processes keep
+        their copy for up to USER_CACHE_TTL seconds."""
+        current_app.user_cache.delete(self.id)
+
     def set_password(self, password):
         """Set a user password."""
         self.password_hash = generate_password_hash(password)
@@ -120,14 +182,31 @@ class User(UserMixin, db.Model):
         return User.query.get(token_id)
 
 
-class Project(db.Model):
+class Project(SearchableMixin, db.Model):
     """A Project contains nodes."""
     __searchable__ = ['name']
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(140))
-    timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow)
+    timestamp = db.Column(db.DateTime, index=True, default=datetime.utcnow,
+                          nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    nodes = db.relationship('Node', backref='project', lazy='dynamic')
+    nodes = db.relationship('Node', backref='project', lazy='dynamic',
+                            passive_deletes=True)
+    edges = db.relationship('Edge', backref='project', lazy='dynamic',
+                            passive_deletes=True)
+    # set when an edge or node removal may have split a weak component
+    components_stale = db.Column(db.Boolean, default=False)
+    # bumped by every change to the nodes or edges of the project
+    revision = db.Column(db.Integer, default=0, nullable=False)
+    # time of the last revision or rename, the Last-Modified date
+    # of the project pages
+    modified = db.Column(db.DateTime, default=datetime.utcnow)
+    # seek indexes for the keyset pagination of the project listings
+    __table_args__ = (
+        db.Index('ix_project_timestamp_id', 'timestamp', 'id'),
+        db.Index('ix_project_user_id_timestamp_id',
+                 'user_id', 'timestamp', 'id'),
+    )
 
     def __repr__(self):
         return '<Project {}>'.format(self.name)
@@ -141,29 +220,334 @@ class Project(db.Model):
                 )
 
     def graph(self):
-        """Returns a dictionary of the whole project
-        that can be used as graph."""
-
-        nodes = self.nodes.all()
-
-        Dict = {}
-        for n in nodes:
-            Dict[n] = n.sinks()
+        """Returns a Graph of the whole project with Node objects
+        as vertices. Loads the nodes and the edges in one query each."""
+        nodes = {n.id: n for n in self.nodes}
+        edges = self._edge_rows().all()
+        missing = {sink_id for (_, sink_id) in edges} - nodes.keys()
+        if missing:
+            # sinks that belong to another project
+            for n in Node.query.filter(Node.id.in_(missing)):
+                nodes[n.id] = n
+
+        Dict = {n: [] for n in nodes.values()}
+        for source_id, sink_id in edges:
+            Dict[nodes[source_id]].append(nodes[sink_id])
 
         graph = Graph(Dict)
         return graph
 
+    def snapshot(self):
+        """Returns a read-only CompactGraph of the whole project.
+        Vertices are node ids, no Node objects are loaded."""
+        node_ids = (node_id for (node_id,) in
+                    db.session.query(Node.id)
+                    .filter(Node.project_id == self.id))
+        return CompactGraph(node_ids, self._edge_rows())
+
+    def bump_revision(self):
+        """Mark the graph of the project as changed."""
+        if self.id is not None:
+            self.revision = Project.revision + 1
+            self.modified = datetime.utcnow()
+
+    @classmethod
+    def before_flush(cls, session, flush_context, instances):
+        """Bump the revision of every project with changed nodes
+        or edges. Renamed projects and the projects linking to the
+        nodes of a renamed user are only marked as modified."""
+        projects, creators = set(), set()
+        with session.no_autoflush:
+            for obj in chain(session.new, session.dirty, session.deleted):
+                if isinstance(obj, User) and obj.id is not None and \
+                        db.inspect(obj).attrs.username.history.has_changes():
+                    creators.add(obj.id)
+                elif isinstance(obj, Project) and \
+                        db.inspect(obj).attrs.name.history.has_changes():
+                    obj.modified = datetime.utcnow()
+                elif isinstance(obj, Node):
+                    projects.add(obj.project)
+                elif isinstance(obj, Edge):
+                    for node in (obj.source, obj.sink):
+                        if node is not None:
+                            projects.add(node.project)
+        for project in projects:
+            if project is not None:
+                project.bump_revision()
+        if creators:
+            created = (db.session.query(Node.project_id)
+                       .filter(Node.creator_id.in_(creators)))
+            session.execute(Project.__table__.update()
+                            .where(Project.id.in_(created))
+                            .values(modified=datetime.utcnow()))
+
+    def analysis(self):
+        """Results of the graph analyses as node ids: the weak
+        components, a topological order or the cycle preventing one,
+        the critical path schedule with unit durations and the
+        redundant edges [source_id, sink_id], None for projects with more
+        than ANALYSIS_MAX_CLOSURE_NODES nodes.
+        Cached per project revision in current_app.analysis_cache."""
+        key = ('analysis', self.id, self.revision)
+        result = current_app.analysis_cache.get(key)
+        if result is None:
+            result = {'weak_components': self.weak_components(),
+                      'order': None,
+                      'cycle': None,
+                      'schedule': None,
+                      'redundant_edges': []}
+            snapshot = self.snapshot()
+            try:
+                result['order'] = snapshot.topsort()
+            except CycleError as error:
+                result['cycle'] = error.cycle
+            else:
+                result['schedule'] = snapshot.schedule()
+                limit = current_app.config['ANALYSIS_MAX_CLOSURE_NODES']
+                if len(snapshot) <= limit:
+                    result['redundant_edges'] = snapshot.redundant_edges()
+                else:
+                    result['redundant_edges'] = None
+            current_app.analysis_cache.set(key, result)
+        return result
+
+    def remove_redundant_edges(self):
+        """Remove the edges that are implied by other paths.
+        Returns the number of removed edges."""
+        redundant = self.analysis()['redundant_edges'] or []
+        ids = {node_id for edge in redundant for node_id in edge}
+        nodes = {n.id: n for n in Node.query.filter(Node.id.in_(ids))}
+        for source_id, sink_id in redundant:
+            nodes[source_id].remove_sink(nodes[sink_id])
+        return len(redundant)
+
+    def topological_order(self):
+        """Query for the nodes of the project in topological order,
+        kept up to date by Node.add_sink."""
+        return self.nodes.order_by(Node.order_key)
+
+    def weak_components(self):
+        """Returns the weak components of the project as lists of node
+        ids. Read from the union find index stored on the nodes. Reads
+        never write, they may come from a replica: a stale index is
+        only bypassed and computed from the edges, the next edge
+        insertion rebuilds it."""
+        if not self.components_stale:
+            rows = (db.session.query(Node.id, Node.component_parent_id)
+                    .filter(Node.project_id == self.id).all())
+            components = DisjointSet(node_id for (node_id, _) in rows)
+            for node_id, parent_id in rows:
+                if parent_id is not None:
+                    if parent_id not in components.parent:
+                        break
+                    components.parent[node_id] = parent_id
+            else:
+                return components.groups()
+        return self._components().groups()
+
+    def _components(self):
+        """Compute the weak components of the project from its edges
+        as a DisjointSet of node ids."""
+        node_ids = [node_id for (node_id,) in
+                    db.session.query(Node.id)
+                    .filter(Node.project_id == self.id)]
+        components = DisjointSet(node_ids)
+        for source_id, sink_id in self._edge_rows():
+            if sink_id in components.parent:
+                components.union(source_id, sink_id)
+        return components
+
+    def _rebuild_component_index(self):
+        """Recompute the union find index of the project from its edges
+        and store it flattened: every node points directly to its root."""
+        components = self._components()
+        mappings = []
+        for node_id in list(components.parent):
+            root = components.find(node_id)
+            mappings.append({
+                'id': node_id,
+                'component_parent_id': None if root == node_id else root,
+                'component_rank': components.rank[node_id]})
+        db.session.bulk_update_mappings(Node, mappings)
+        self._expire_nodes('component_parent_id', 'component_rank')
+        self.components_stale = False
+
+    def _expire_nodes(self, *attributes):
+        """Expire attributes of the loaded nodes of the project
+        after a bulk statement changed them in the database."""
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, Node) and obj.project_id == self.id:
+                db.session.expire(obj, attributes)
+
+    def connect_many(self, pairs):
+        """Add the edges source_id -> sink_id for a batch of node id
+        pairs of the project. Existing edges are skipped. The order keys
+        and the edges of the batch nodes are read with one existence
+        check query, then the edges between nodes with keys in the range
+        spanned by the pairs against the topological order are loaded,
+        the order keys are moved in memory and the new edges are
+        inserted with one executemany statement.
+        Raises ValueError for nodes outside the project and CycleError
+        (with node ids) if the edges would create a cycle, in which case
+        nothing is changed. Returns the number of added edges."""
+        pairs = [(int(source), int(sink)) for source, sink in pairs]
+        Project.lock([self.id])
+        ids = sorted({i for pair in pairs for i in pair})
+        # the order keys of the batch nodes together with their edges
+        keys, members, existing = {}, set(), set()
+        for batch in _batches(ids):
+            for node_id, project_id, key, sink_id in (
+                    db.session.query(Node.id, Node.project_id,
+                                     Node.order_key, Edge.sink_id)
+                    .outerjoin(Edge, Edge.source_id == Node.id)
+                    .filter(Node.id.in_(batch))):
+                keys[node_id] = key
+                if project_id == self.id:
+                    members.add(node_id)
+                if sink_id is not None:
+                    existing.add((node_id, sink_id))
+        outside = set(ids) - members
+        if outside:
+            raise ValueError('Nodes {} are not part of the project'
+                             .format(sorted(outside)))
+
+        graph = Graph()
+        backward = [(keys[sink], keys[source]) for source, sink in pairs
+                    if keys[sink] <= keys[source]]
+        if backward:
+            # the reordering only visits nodes with keys between those of
+            # the sink and the source, across projects, and only moves
+            # keys among them
+            lower = min(low for low, _ in backward)
+            upper = max(high for _, high in backward)
+            source, sink = db.aliased(Node), db.aliased(Node)
+            for source_id, sink_id, source_key, sink_key in (
+                    db.session.query(Edge.source_id, Edge.sink_id,
+                                     source.order_key, sink.order_key)
+                    .join(source, Edge.source_id == source.id)
+                    .join(sink, Edge.sink_id == sink.id)
+                    .filter(source.order_key.between(lower, upper),
+                            sink.order_key.between(lower, upper))):
+                keys[source_id], keys[sink_id] = source_key, sink_key
+                graph.add_edge([source_id, sink_id])
+        original = dict(keys)
+        added = []
+        for source, sink in pairs:
+            if source == sink or (source, sink) in existing:
+                continue
+            keys.update(reorder_for_edge(source, sink, key=keys.get,
+                                         sinks=graph.sinks,
+                                         sources=graph.sources))
+            graph.add_edge([source, sink])
+            existing.add((source, sink))
+            added.append({'source_id': source, 'sink_id': sink,
+                          'project_id': self.id})
+        if not added:
+            return 0
+
+        db.session.execute(Edge.__table__.insert(), added)
+        moved = [{'node_id': i, 'key': key} for i, key in keys.items()
+                 if original[i] != key]
+        if moved:
+            db.session.execute(
+                Node.__table__.update()
+                .where(Node.id == db.bindparam('node_id'))
+                .values(topo_order=db.bindparam('key')), moved)
+            self._expire_nodes('topo_order')
+        self.components_stale = True
+        self.bump_revision()
+        return len(added)
+
+    def disconnect_many(self, pairs):
+        """Remove the edges source_id -> sink_id of the project for a
+        batch of node id pairs with one executemany statement.
+        Returns the number of removed edges."""
+        rows = [{'source': int(source), 'sink': int(sink)}
+                for source, sink in pairs]
+        if not rows:
+            return 0
+        result = db.session.execute(
+            Edge.__table__.delete()
+            .where(Edge.project_id == self.id)
+            .where(Edge.source_id == db.bindparam('source'))
+            .where(Edge.sink_id == db.bindparam('sink')), rows)
+        if result.rowcount:
+            self.components_stale = True
+            self.bump_revision()
+        return result.rowcount
+
+    @staticmethod
+    def load_nodes(project_id):
+        """Load the nodes of a project together with their creators
+        in one query."""
+        return (Node.query.options(db.joinedload(Node.created_by))
+                .filter(Node.project_id == project_id)
+                .order_by(Node.id).all())
+
+    def _edge_rows(self):
+        """Query for the (source_id, sink_id) pairs of all edges
+        starting in the project."""
+        return (db.session.query(Edge.source_id, Edge.sink_id)
+                .filter(Edge.project_id == self.id))
+
     def delete(self):
-        for node in self.nodes.all():
-            node.delete()
+        """Delete the project with all its nodes and edges
+        in a constant number of set-based statements."""
+        node_ids = (db.session.query(Node.id)
+                    .filter(Node.project_id == self.id))
+        edges = Edge.query.filter(db.or_(Edge.project_id == self.id,
+                                         Edge.sink_id.in_(node_ids)))
+        # edges from other projects into this one
+        others = [project_id for (project_id,) in
+                  edges.with_entities(Edge.project_id).distinct()
+                  if project_id != self.id]
+        edges.delete(synchronize_session='fetch')
+        Project._mark_changed(others)
+        Node.remove_ids(db.session, [node_id for (node_id,) in node_ids])
+        (Node.query.filter(Node.project_id == self.id)
+         .delete(synchronize_session='fetch'))
         db.session.delete(self)
 
+    @staticmethod
+    def lock(project_ids):
+        """Lock the rows of the projects (SELECT ... FOR UPDATE) until
+        the end of the transaction, so that concurrent changes to their
+        graphs are checked one after the other. The projects and the
+        order keys and union find parents of the loaded nodes are
+        reloaded, another transaction may have changed them."""
+        ids = sorted({i for i in project_ids if i is not None})
+        if not ids:
+            return
+        # populate_existing skips the autoflush
+        db.session.flush()
+        (Project.query.filter(Project.id.in_(ids)).order_by(Project.id)
+         .with_for_update().populate_existing().all())
+        for obj in list(db.session.identity_map.values()):
+            if isinstance(obj, Node):
+                db.session.expire(obj, ['topo_order', 'component_parent_id',
+                                        'component_rank'])
+
+    @staticmethod
+    def _mark_changed(project_ids):
+        """Bump the revision and invalidate the weak component index
+        of projects that lost edges to a bulk statement."""
+        if project_ids:
+            (Project.query.filter(Project.id.in_(project_ids))
+             .update({Project.revision: Project.revision + 1,
+                      Project.modified: datetime.utcnow(),
+                      Project.components_stale: True},
+                     synchronize_session='fetch'))
+
 
 def uid_gen() -> str:
     uid = str(uuid4())
     return "{}@{}.org".format(uid, uid[:4])
 
 
+# Nodes of a node page, see Node.load_page
+NodePage = namedtuple('NodePage', ['node', 'sources', 'sinks'])
+
+
 # Model for Nodes
 # Nodes are part of a project
 # A project is finished when all nodes are completed
@@ -171,32 +555,66 @@ def uid_gen() -> str:
 
 class Edge(db.Model):
     __tablename__ = 'edge'
+    __table_args__ = (
+        db.UniqueConstraint('source_id', 'sink_id',
+                            name='uq_edge_source_id_sink_id'),
+        db.Index('ix_edge_sink_id_source_id', 'sink_id', 'source_id'),
+        db.Index('ix_edge_project_id_source_id_sink_id',
+                 'project_id', 'source_id', 'sink_id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
-    source_id = db.Column(db.Integer, db.ForeignKey('node.id'))
-    sink_id = db.Column(db.Integer, db.ForeignKey('node.id'))
+    source_id = db.Column(db.Integer,
+                          db.ForeignKey('node.id', ondelete='CASCADE'))
+    sink_id = db.Column(db.Integer,
+                        db.ForeignKey('node.id', ondelete='CASCADE'))
+    # project of the source node, copied to load a project in one scan
+    project_id = db.Column(db.Integer,
+                           db.ForeignKey('project.id', ondelete='CASCADE'))
 
     def __repr__(self):
         return '<Source {}, Sink {}>'.format(self.source_id, self.sink_id)
 
 
-class Node(db.Model):
+class Node(SearchableMixin, db.Model):
     """Nodes are the basic elements of a project.
     Each node can only be in one project.
     They are connected via edges."""
     __tablename__ = 'node'
+    __searchable__ = ['name']
     id = db.Column(db.Integer, primary_key=True)
-    project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
+    project_id = db.Column(db.Integer,
+                           db.ForeignKey('project.id', ondelete='CASCADE'))
     name = db.Column(db.String(140))
     creator_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    # stable id of the node in imported and exported graphs
+    external_id = db.Column(db.String(64))
+    # union find index of the weak components of the project,
+    # a node without parent is the root of its component
+    component_parent_id = db.Column(db.Integer)
+    component_rank = db.Column(db.Integer, default=0)
+    # topological order key, nodes that never moved use their id
+    topo_order = db.Column(db.Integer)
+    __table_args__ = (
+        db.UniqueConstraint('project_id', 'external_id',
+                            name='uq_node_project_id_external_id'),
+        # on the expression the queries use, see Node.order_key
+        db.Index('ix_node_project_id_order_key', 'project_id',
+                 db.func.coalesce(topo_order, id)),
+        # new nodes use their id as order key, SQLite must not reuse
+        # the id of a deleted node
+        {'sqlite_autoincrement': True},
+    )
 
     edges_sinks = db.relationship('Edge', backref='source',
                                   primaryjoin=(id == Edge.source_id),
-                                  lazy='dynamic', cascade="all, delete-orphan")
+                                  lazy='dynamic', cascade="all, delete-orphan",
+                                  passive_deletes=True)
 
     edges_sources = db.relationship('Edge', backref='sink',
                                     primaryjoin=(id == Edge.sink_id),
                                     lazy='dynamic',
-                                    cascade="all, delete-orphan")
+                                    cascade="all, delete-orphan",
+                                    passive_deletes=True)
 
     def __repr__(self):
         return '<Node {}>'.format(self.name)
@@ -209,23 +627,36 @@ class Node(db.Model):
                 .format(digest, size)
                 )
 
+    def _sources_query(self):
+        return (Node.query.join(Edge, Edge.source_id == Node.id)
+                .filter(Edge.sink_id == self.id).order_by(Edge.id))
+
+    def _sinks_query(self):
+        return (Node.query.join(Edge, Edge.sink_id == Node.id)
+                .filter(Edge.source_id == self.id).order_by(Edge.id))
+
     def sources(self):
         """Create  list of nodes that are sources"""
-        lst = []
-        edges = self.edges_sources.all()
-        for e in edges:
-            node = e.source
-            lst.append(node)
-        return lst
+        return self._sources_query().all()
 
     def sinks(self):
         """Create a list of nodes that are sinks"""
-        lst = []
-        edges = self.edges_sinks.all()
-        for e in edges:
-            node = e.sink
-            lst.append(node)
-        return lst
+        return self._sinks_query().all()
+
+    @staticmethod
+    def load_page(node_id):
+        """Load a node with its project, creator, sources and sinks
+        (including their creators) in three queries.
+        Returns a NodePage or None if there is no such node."""
+        node = (Node.query.options(db.joinedload(Node.project),
+                                   db.joinedload(Node.created_by))
+                .filter(Node.id == node_id).first())
+        if node is None:
+            return None
+        creator = db.joinedload(Node.created_by)
+        return NodePage(node=node,
+                        sources=node._sources_query().options(creator).all(),
+                        sinks=node._sinks_query().options(creator).all())
 
     def is_sink_for(self, node):
         """Check if self is a sink for node"""
@@ -242,13 +673,98 @@ class Node(db.Model):
                 or self == node
                 )
 
+    @hybrid_property
+    def order_key(self):
+        """Key of the node in the topological order."""
+        return self.topo_order if self.topo_order is not None else self.id
+
+    @order_key.expression
+    def order_key(cls):
+        return db.func.coalesce(cls.topo_order, cls.id)
+
     def add_sink(self, node):
-        """add a node as a sink"""
+        """add a node as a sink.
+        Raises CycleError if node already reaches self."""
+        Project.lock([n.project.id for n in (self, node)
+                      if n.project is not None])
         if not self.is_connected_to(node):
+            self._reorder(node)
             e = Edge()
             e.sink = node
             e.source = self
+            e.project = self.project
             self.edges_sinks.append(e)
+            self._join_component(node)
+
+    def _reorder(self, node):
+        """Move the order keys of the nodes between node and self
+        so that self comes before node (Pearce-Kelly). The affected
+        region is found with two recursive queries bounded by the keys
+        of both nodes. Raises CycleError if node already reaches self."""
+        lower, upper = node.order_key, self.order_key
+        if upper < lower:
+            return
+        forward = dict(node._reach(lower, upper))
+        if self.id in forward:
+            cycle = [self.id]
+            while cycle[-1] != node.id and forward[cycle[-1]] not in cycle:
+                cycle.append(forward[cycle[-1]])
+            cycle.reverse()
+            nodes = {n.id: n for n in
+                     Node.query.filter(Node.id.in_(cycle))}
+            raise CycleError([nodes[i] for i in cycle])
+        backward = dict(self._reach(lower, upper, backward=True))
+
+        ids = forward.keys() | backward.keys() | {node.id, self.id}
+        nodes = {n.id: n for n in Node.query.filter(Node.id.in_(ids))}
+        moved = reassign_keys(
+            [nodes[i] for i in backward.keys() | {self.id}],
+            [nodes[i] for i in forward.keys() | {node.id}],
+            key=lambda n: n.order_key)
+        for n, key in moved.items():
+            n.topo_order = key
+
+    def _reach(self, lower, upper, backward=False, max_depth=None):
+        """Recursive query for the nodes reachable from self (or reaching
+        self if backward) through nodes with order keys in [lower, upper].
+        Rows are (id, parent) pairs, parent being the node the row was
+        reached from. UNION drops repeated rows, so the query terminates
+        on cyclic data, too. With max_depth rows also carry their depth
+        and the recursion stops after max_depth edges."""
+        if backward:
+            near, far = Edge.sink_id, Edge.source_id
+        else:
+            near, far = Edge.source_id, Edge.sink_id
+        key = Node.order_key
+
+        columns = [far.label('id'), near.label('parent')]
+        if max_depth is not None:
+            columns.append(db.literal(1).label('depth'))
+        reach = (db.session.query(*columns)
+                 .join(Node, Node.id == far)
+                 .filter(near == self.id, key.between(lower, upper))
+                 .cte('reach', recursive=True))
+
+        if max_depth is None:
+            step = db.session.query(far, near)
+        else:
+            step = (db.session.query(far, near, reach.c.depth + 1)
+                    .filter(reach.c.depth < max_depth))
+        step = (step.join(reach, near == reach.c.id)
+                .join(Node, Node.id == far)
+                .filter(key.between(lower, upper)))
+        return db.session.query(reach.union(step))
+
+    def reaches(self, node, max_depth=None):
+        """Check with a recursive query if there is a path from self to
+        node, optionally of at most max_depth edges. Only nodes with
+        order keys between the keys of both nodes can be on the path."""
+        lower, upper = self.order_key, node.order_key
+        if upper < lower:
+            return False
+        reach = self._reach(lower, upper, max_depth=max_depth).subquery()
+        return db.session.query(
+            db.exists().where(reach.c.id == node.id)).scalar()
 
     def add_source(self, node):
         """add a node as a source"""
@@ -259,14 +775,67 @@ class Node(db.Model):
         if self.is_source_for(node):
             e = self.edges_sinks.filter(Edge.sink_id == node.id).first()
             self.edges_sinks.remove(e)
+            for n in (self, node):
+                if n.project is not None:
+                    n.project.bump_revision()
+            if self.project is not None:
+                self.project.components_stale = True
 
     def remove_source(self, node):
         """remove a node as a source"""
         node.remove_sink(self)
 
+    def _component_root(self):
+        """Find the root of the weak component of the node in the
+        union find index, compressing the path on the way."""
+        root = self
+        path = []
+        while root is not None and root.component_parent_id is not None:
+            path.append(root)
+            root = Node.query.get(root.component_parent_id)
+        if root is not None:
+            for node in path:
+                node.component_parent_id = root.id
+        return root
+
+    def _join_component(self, node):
+        """Union the weak components of self and node
+        in the union find index of the project."""
+        project = self.project
+        if project is None or node.project is not project:
+            return
+        if project.components_stale:
+            # includes the new edge, the query flushes it
+            project._rebuild_component_index()
+            return
+        root, other = self._component_root(), node._component_root()
+        if root is None or other is None or root.id is None \
+                or other.id is None:
+            project.components_stale = True
+            return
+        if root is other:
+            return
+        if (root.component_rank or 0) < (other.component_rank or 0):
+            root, other = other, root
+        other.component_parent_id = root.id
+        if (root.component_rank or 0) == (other.component_rank or 0):
+            root.component_rank = (root.component_rank or 0) + 1
+
     def delete(self):
-        for sink in self.sinks():
-            self.remove_sink(sink)
-        for source in self.sources():
-            self.remove_source(source)
+        """Delete the node with all its edges in a constant
+        number of set-based statements."""
+        edges = Edge.query.filter(db.or_(Edge.source_id == self.id,
+                                         Edge.sink_id == self.id))
+        projects = [project_id for (project_id,) in
+                    edges.with_entities(Edge.project_id).distinct()]
+        edges.delete(synchronize_session='fetch')
+        Project._mark_changed(projects)
         db.session.delete(self)
+
+
+db.event.listen(db.session, 'before_flush', Project.before_flush)
+db.event.listen(db.session, 'after_flush', SearchableMixin.after_flush)
+db.event.listen(db.session, 'after_commit', SearchableMixin.after_commit)
+db.event.listen(db.session, 'after_rollback', SearchableMixin.after_rollback)
+db.event.listen(db.metadata, 'after_create', create_tables)
+db.event.listen(db.metadata, 'before_drop', drop_tables)
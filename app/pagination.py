@@ -0,0 +1,56 @@
+"""Keyset pagination with opaque cursors."""
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import namedtuple
+from datetime import datetime
+from sqlalchemy import tuple_
+
+KeysetPage = namedtuple('KeysetPage', ['items', 'next_cursor', 'prev_cursor'])
+
+
+def encode_cursor(timestamp, id):
+    """Return an url safe token for the position (timestamp, id)."""
+    raw = '{}|{}'.format(timestamp.isoformat(), id)
+    return urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the (timestamp, id) encoded in cursor. Raises ValueError
+    for malformed cursors."""
+    try:
+        raw = urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        timestamp, id = raw.decode('utf-8').split('|')
+        return datetime.fromisoformat(timestamp), int(id)
+    except (TypeError, UnicodeDecodeError, ValueError) as error:
+        raise ValueError('invalid cursor {!r}'.format(cursor)) from error
+
+
+def keyset_paginate(query, timestamp, id, per_page, after=None, before=None):
+    """Return one page of query ordered by (timestamp, id) descending.
+
+    after continues with older items than the cursor, before goes back
+    to newer ones. The page is found by seeking in the index on
+    (timestamp, id) instead of an OFFSET scan and no total is counted.
+    """
+    key = tuple_(timestamp, id)
+    if before is not None:
+        rows = (query.filter(key > tuple_(*decode_cursor(before)))
+                .order_by(timestamp.asc(), id.asc())
+                .limit(per_page + 1).all())
+        more = len(rows) > per_page
+        items = rows[:per_page][::-1]
+        newer, older = more, bool(items)
+    else:
+        if after is not None:
+            query = query.filter(key < tuple_(*decode_cursor(after)))
+        rows = (query.order_by(timestamp.desc(), id.desc())
+                .limit(per_page + 1).all())
+        more = len(rows) > per_page
+        items = rows[:per_page]
+        newer, older = after is not None and bool(items), more
+
+    def cursor(item):
+        return encode_cursor(getattr(item, timestamp.key),
+                             getattr(item, id.key))
+    return KeysetPage(items,
+                      cursor(items[-1]) if older else None,
+                      cursor(items[0]) if newer else None)
@@ -0,0 +1,92 @@
+"""Rebuilding the search index in id ranges."""
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import current_app
+from app import db
+
+
+def index_range(model, low, high, chunk_size=1000):
+    """Index the objects of model with low <= id < high, reading them
+    chunk_size at a time. Returns the number of indexed objects."""
+    query = (model.query.filter(model.id >= low, model.id < high)
+             .order_by(model.id).yield_per(chunk_size))
+    count, chunk = 0, []
+    for obj in query:
+        chunk.append(obj)
+        if len(chunk) == chunk_size:
+            current_app.search.write(db.session, chunk)
+            count, chunk = count + len(chunk), []
+    if chunk:
+        current_app.search.write(db.session, chunk)
+        count += len(chunk)
+    db.session.commit()
+    return count
+
+
+def _index_range_in_context(app, *args):
+    with app.app_context():
+        try:
+            return index_range(*args)
+        finally:
+            db.session.remove()
+
+
+def reindex(model, after=None, workers=1, range_size=10000,
+            chunk_size=1000):
+    """Index all objects of model with an id greater than after.
+
+    The ids are split into ranges of range_size that are indexed by a
+    pool of workers threads, or inline with one worker or a backend
+    without parallel writes. Yields
+    (last_id, count) whenever the ranges up to last_id are all done,
+    count being the number of objects indexed by then.
+    """
+    query = db.session.query(db.func.min(model.id), db.func.max(model.id))
+    if after is not None:
+        query = query.filter(model.id > after)
+    first, last = query.one()
+    if first is None:
+        return
+    ranges = [(low, min(low + range_size, last + 1))
+              for low in range(first, last + 1, range_size)]
+    count = 0
+    if workers == 1 or not current_app.search.parallel_writes:
+        for low, high in ranges:
+            count += index_range(model, low, high, chunk_size)
+            yield high - 1, count
+        return
+
+    app = current_app._get_current_object()
+    done, position = {}, 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(_index_range_in_context, app, model,
+                               low, high, chunk_size): (low, high)
+                   for low, high in ranges}
+        for future in as_completed(futures):
+            if future.exception() is not None:
+                for pending in futures:
+                    pending.cancel()
+                raise future.exception()
+            done[futures[future]] = future.result()
+            advanced = False
+            while position < len(ranges) and ranges[position] in done:
+                count += done.pop(ranges[position])
+                position += 1
+                advanced = True
+            if advanced:
+                yield ranges[position - 1][1] - 1, count
+
+
+def read_checkpoint(path):
+    """Return the last id stored at path or None."""
+    if not os.path.exists(path):
+        return None
+    with open(path) as checkpoint:
+        return int(checkpoint.read().strip())
+
+
+def write_checkpoint(path, last_id):
+    partial = path + '.tmp'
+    with open(partial, 'w') as checkpoint:
+        checkpoint.write(str(last_id))
+    os.replace(partial, path)
@@ -0,0 +1,74 @@
+"""Routing of read-only views to a read replica."""
+from functools import wraps
+from time import time
+from flask import g, has_request_context, request, session as flask_session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from sqlalchemy import event, orm
+from sqlalchemy.sql.dml import UpdateBase
+
+
+def read_only(f):
+    """Mark a view as read-only. Its GET requests read from the
+    'replica' bind when one is configured."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            g.read_only = True
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+class RoutingSession(SignallingSession):
+    """Session sending the reads of read-only views to the replica.
+    Flushes, bulk operations and DML statements always use the primary
+    and once the session has written, all further reads do too."""
+
+    def get_bind(self, mapper=None, clause=None):
+        if self._flushing or isinstance(clause, UpdateBase):
+            self.info['wrote'] = True
+        elif self._reads_from_replica():
+            return self.app.extensions['sqlalchemy'].db.get_engine(
+                self.app, bind='replica')
+        return SignallingSession.get_bind(self, mapper, clause)
+
+    def _reads_from_replica(self):
+        if self.info.get('wrote') or not has_request_context():
+            return False
+        if not g.get('read_only') or not _has_replica(self.app):
+            return False
+        # read your writes: the replica may lag behind a recent commit
+        return flask_session.get('read_primary_until', 0) <= time()
+
+    def bulk_save_objects(self, *args, **kwargs):
+        self.info['wrote'] = True
+        return SignallingSession.bulk_save_objects(self, *args, **kwargs)
+
+    def bulk_insert_mappings(self, *args, **kwargs):
+        self.info['wrote'] = True
+        return SignallingSession.bulk_insert_mappings(self, *args, **kwargs)
+
+    def bulk_update_mappings(self, *args, **kwargs):
+        self.info['wrote'] = True
+        return SignallingSession.bulk_update_mappings(self, *args, **kwargs)
+
+
+def _has_replica(app):
+    return 'replica' in (app.config['SQLALCHEMY_BINDS'] or {})
+
+
+def _read_primary_after_write(session):
+    """Send the reads of the same browser session to the primary until
+    the replica has most likely caught up."""
+    if (session.info.get('wrote') and has_request_context()
+            and _has_replica(session.app)):
+        flask_session['read_primary_until'] = (
+            time() + session.app.config['REPLICA_READ_AFTER_WRITE'])
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+    """SQLAlchemy extension whose sessions are RoutingSessions."""
+
+    def create_session(self, options):
+        factory = orm.sessionmaker(class_=RoutingSession, db=self, **options)
+        event.listen(factory, 'after_commit', _read_primary_after_write)
+        return factory
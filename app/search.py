@@ -1,24 +1,454 @@
-from flask import current_app
-
-def add_to_index(index,model):
-    if not current_app.elasticsearch:
-        return
-    payload = {}
-    for field in model.__searchable__:
-        payload[field] = getattr(model, field)
-    current_app.elasticsearch.index(index=index, id=model.id, body=payload)
-
-def remove_from_index(index, model):
-    if not current_app.elasticsearch:
-        return
-    current_app.elasticsearch.delete(index=index, id=model.id)
-
-def query_index(index, query, page, per_page):
-    if not current_app.elasticsearch:
+"""Search backends.
+
+A backend indexes searchable objects (see SearchableMixin in
+app/models.py) and answers queries with one page of ranked ids.
+
+- add(session, objects) and remove(session, objects) update the index,
+  remove_ids(session, index, ids) removes objects deleted in bulk.
+  Transactional backends are called inside the flush that changed the
+  objects and write through the session.
+- Other backends turn the changes into actions(added, removed) during
+  the flush and get them with submit(actions) after the commit.
+- write(session, objects) indexes objects right away, for reindexing.
+- query(session, index, expression, page, per_page) returns
+  (ids, total).
+"""
+import atexit
+import logging
+import re
+from collections import OrderedDict
+from queue import Full
+from threading import Condition, Thread
+from time import monotonic, sleep
+from sqlalchemy import text
+
+
+def _words(expression):
+    return re.findall(r'\w+', expression.lower())
+
+
+class NullBackend():
+    """Backend for databases without full-text search, finds nothing."""
+    transactional = True
+    # whether write() may be called from several threads at once
+    parallel_writes = True
+
+    def add(self, session, objects):
+        pass
+
+    def remove(self, session, objects):
+        pass
+
+    def remove_ids(self, session, index, ids):
+        pass
+
+    def write(self, session, objects):
+        """Index objects right away, used by reindexing."""
+        self.add(session, objects)
+
+    def query(self, session, index, expression, page, per_page):
         return [], 0
-    search = current_app.elasticsearch.search(
-        index=index,
-        body={'query': {'multi_match': {'query': query, 'fields': ['*']}},
-            'from': (page -1)*per_page, 'size': per_page})
-    ids = [int(hit['_id']) for hit in search['hits']['hits']]
-    return ids, search['hits']['total']['value']
+
+
+class ElasticsearchBackend():
+    """One Elasticsearch index per model with its __searchable__ fields.
+    Changes are sent in the background by an IndexingQueue."""
+    transactional = False
+    parallel_writes = True
+
+    def __init__(self, client, queue=None):
+        self.client = client
+        self.queue = queue if queue is not None else IndexingQueue(client)
+
+    @staticmethod
+    def actions(added=(), removed=()):
+        """Return the bulk actions for objects added and removed. The
+        documents are read right away, while the objects are loaded."""
+        actions = [('index', obj.__tablename__, obj.id,
+                    {field: getattr(obj, field)
+                     for field in obj.__searchable__})
+                   for obj in added]
+        actions += [('delete', obj.__tablename__, obj.id, None)
+                    for obj in removed]
+        return actions
+
+    def submit(self, actions):
+        self.queue.put(actions)
+
+    @staticmethod
+    def delete_actions(index, ids):
+        """Return the bulk actions removing the ids from index."""
+        return [('delete', index, id, None) for id in ids]
+
+    def add(self, session, objects):
+        self.submit(self.actions(added=objects))
+
+    def remove(self, session, objects):
+        self.submit(self.actions(removed=objects))
+
+    def write(self, session, objects):
+        """Index objects with bulk requests before returning. Raises
+        RuntimeError if some could not be indexed."""
+        queue = IndexingQueue(self.client, batch_size=self.queue.batch_size,
+                              retries=self.queue.retries, start=False,
+                              logger=self.queue.logger)
+        queue.put(self.actions(added=objects))
+        queue.flush()
+        if queue.failed:
+            raise RuntimeError('Could not index {} objects'
+                               .format(queue.failed))
+
+    def query(self, session, index, expression, page, per_page):
+        search = self.client.search(
+            index=index,
+            body={'query': {'multi_match': {'query': expression,
+                                            'fields': ['*']}},
+                  'from': (page - 1) * per_page, 'size': per_page})
+        ids = [int(hit['_id']) for hit in search['hits']['hits']]
+        return ids, search['hits']['total']['value']
+
+
+class IndexingQueue():
+    """Bounded queue of Elasticsearch actions sent with the bulk API by
+    a background thread.
+
+    Actions are (op, index, id, document) with op 'index' or 'delete'.
+    A newer action for the same (index, id) replaces a pending one. A
+    batch is sent once batch_size actions are pending or the oldest has
+    waited interval seconds. Failed requests and items rejected with
+    429 or 5xx are retried up to retries times with exponential backoff,
+    then dropped and counted as failed. put() blocks while maxsize
+    actions are pending. With start=False no thread is started and
+    flush() has to be called, as in the tests.
+    """
+
+    def __init__(self, client, maxsize=10000, batch_size=500, interval=1.0,
+                 retries=5, backoff=0.5, start=True, logger=None,
+                 clock=monotonic, sleep=sleep):
+        self.client = client
+        self.logger = logger or logging.getLogger(__name__)
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.interval = interval
+        self.retries = retries
+        self.backoff = backoff
+        self.sent = self.failed = self.retried = 0
+        self._clock = clock
+        self._sleep = sleep
+        # (index, id) -> (action, time first enqueued)
+        self._pending = OrderedDict()
+        self._condition = Condition()
+        self._start = start
+        self._thread = None
+        self._closed = False
+
+    def __len__(self):
+        return len(self._pending)
+
+    def put(self, actions, timeout=None):
+        """Enqueue actions, waiting for room if the queue is full.
+        Raises queue.Full if there is still no room after timeout."""
+        with self._condition:
+            for action in actions:
+                key = action[1], action[2]
+                while (key not in self._pending
+                       and len(self._pending) >= self.maxsize):
+                    self._condition.notify_all()
+                    if not self._condition.wait(timeout):
+                        raise Full('Indexing queue is full')
+                # a replaced action keeps its place and enqueue time
+                since = self._pending.get(key, (None, self._clock()))[1]
+                self._pending[key] = (action, since)
+            if self._start and self._thread is None:
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+            self._condition.notify_all()
+
+    def lag(self):
+        """Seconds the oldest pending action has waited."""
+        with self._condition:
+            if not self._pending:
+                return 0.0
+            return self._clock() - next(iter(self._pending.values()))[1]
+
+    def report(self):
+        """Return the queue length, lag and counters."""
+        return {'pending': len(self), 'lag': self.lag(), 'sent': self.sent,
+                'failed': self.failed, 'retried': self.retried}
+
+    def flush(self):
+        """Send all pending actions, batch_size at a time."""
+        while self._pending:
+            self._send(self._take())
+
+    def close(self):
+        """Stop the thread once everything pending has been sent."""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def _take(self):
+        with self._condition:
+            batch = []
+            while self._pending and len(batch) < self.batch_size:
+                batch.append(self._pending.popitem(last=False)[1][0])
+            self._condition.notify_all()
+            return batch
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed and not self._due():
+                    self._condition.wait(self._wait_time())
+                if self._closed and not self._pending:
+                    return
+            self._send(self._take())
+            lag = self.lag()
+            if lag > 10 * self.interval:
+                self.logger.warning('Search indexing is %.1f seconds and '
+                                    '%d actions behind', lag, len(self))
+
+    def _due(self):
+        return len(self._pending) >= self.batch_size or (
+            self._pending and self._wait_time() <= 0)
+
+    def _wait_time(self):
+        if not self._pending:
+            return None
+        oldest = next(iter(self._pending.values()))[1]
+        return oldest + self.interval - self._clock()
+
+    def _send(self, batch):
+        for attempt in range(self.retries + 1):
+            if not batch:
+                return
+            if attempt:
+                self.retried += len(batch)
+                self._sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                response = self.client.bulk(body=self._body(batch))
+            except Exception:
+                self.logger.warning('Bulk indexing request failed',
+                                    exc_info=True)
+                continue
+            batch = self._rejected(batch, response)
+        if batch:
+            self.failed += len(batch)
+            self.logger.error('Dropped %d search index actions',
+                              len(batch))
+
+    @staticmethod
+    def _body(batch):
+        body = []
+        for op, index, id, document in batch:
+            body.append({op: {'_index': index, '_id': id}})
+            if document is not None:
+                body.append(document)
+        return body
+
+    def _rejected(self, batch, response):
+        """Count the accepted actions and return those to retry."""
+        if not response.get('errors'):
+            self.sent += len(batch)
+            return []
+        retry = []
+        for action, item in zip(batch, response['items']):
+            status = item[action[0]]['status']
+            if status == 429 or status >= 500:
+                retry.append(action)
+            elif status >= 400 and not (action[0] == 'delete'
+                                        and status == 404):
+                self.failed += 1
+                self.logger.error('Could not index %s %s: %s',
+                                  action[1], action[2], item)
+            else:
+                self.sent += 1
+        return retry
+
+
+class DatabaseBackend(NullBackend):
+    """Full-text index inside the application database.
+
+    The table search_entry holds one row per project name and one per
+    node name. Project rows have the id 2 * project.id, node rows
+    2 * node.id + 1, and every row carries the project id. A project
+    search finds projects by their own name and by the names of their
+    nodes, where a match in the project name ranks higher. Like the
+    multi_match query of Elasticsearch, any of the words (or a word
+    starting with them) may match.
+    """
+    create_statements = ()
+    drop_statements = ()
+    upsert_statements = ()
+    delete_statement = 'DELETE FROM search_entry WHERE id = :id'
+    delete_project_statement = ('DELETE FROM search_entry '
+                                'WHERE project_id = :project_id')
+    project_query = node_query = None
+    # the query parameter: the words formatted with match_term,
+    # joined with match_operator
+    match_term = match_operator = None
+
+    def add(self, session, objects):
+        rows = [self._row(obj) for obj in objects]
+        rows = [row for row in rows if row['project_id'] is not None]
+        if rows:
+            for statement in self.upsert_statements:
+                session.execute(text(statement), rows)
+
+    def remove(self, session, objects):
+        rows = [self._row(obj) for obj in objects]
+        projects = [{'project_id': row['project_id']} for row in rows
+                    if row['id'] % 2 == 0]
+        if rows:
+            session.execute(text(self.delete_statement), rows)
+        if projects:
+            session.execute(text(self.delete_project_statement), projects)
+
+    def remove_ids(self, session, index, ids):
+        offset = 0 if index == 'project' else 1
+        rows = [{'id': 2 * id + offset} for id in ids]
+        if rows:
+            session.execute(text(self.delete_statement), rows)
+
+    @staticmethod
+    def _row(obj):
+        if obj.__tablename__ == 'project':
+            return {'id': 2 * obj.id, 'project_id': obj.id,
+                    'text': obj.name or '', 'weight': 'A'}
+        return {'id': 2 * obj.id + 1, 'project_id': obj.project_id,
+                'text': obj.name or '', 'weight': 'B'}
+
+    def query(self, session, index, expression, page, per_page):
+        words = _words(expression)
+        statement = {'project': self.project_query,
+                     'node': self.node_query}.get(index)
+        if not words or statement is None:
+            return [], 0
+        match = self.match_operator.join(self.match_term.format(word)
+                                         for word in words)
+        rows = session.execute(text(statement), {
+            'query': match, 'limit': per_page,
+            'offset': (page - 1) * per_page}).fetchall()
+        return [row[0] for row in rows], rows[0][1] if rows else 0
+
+
+class SQLiteBackend(DatabaseBackend):
+    """search_entry is an FTS5 table ranked with bm25."""
+    # SQLite has a single writer, concurrent writers only wait on it
+    parallel_writes = False
+    create_statements = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_entry USING "
+        "fts5(text, project_id UNINDEXED, prefix='2 3')",
+    )
+    drop_statements = ('DROP TABLE IF EXISTS search_entry',)
+    upsert_statements = (
+        'DELETE FROM search_entry WHERE rowid = :id',
+        'INSERT INTO search_entry (rowid, text, project_id) '
+        'VALUES (:id, :text, :project_id)',
+    )
+    delete_statement = 'DELETE FROM search_entry WHERE rowid = :id'
+    # bm25 is negative, better matches are smaller. It cannot be used
+    # inside an aggregate, LIMIT -1 keeps SQLite from flattening the
+    # innermost query into the grouping one.
+    project_query = (
+        'SELECT project.id, count(*) OVER () FROM ('
+        ' SELECT project_id, min(score) AS score FROM ('
+        '  SELECT project_id, bm25(search_entry)'
+        '   * CASE WHEN rowid % 2 = 0 THEN 2.0 ELSE 1.0 END AS score'
+        '  FROM search_entry WHERE search_entry MATCH :query LIMIT -1)'
+        ' GROUP BY project_id) AS hit'
+        ' JOIN project ON project.id = hit.project_id'
+        ' ORDER BY hit.score, project.id DESC LIMIT :limit OFFSET :offset')
+    node_query = (
+        'SELECT node.id, count(*) OVER () FROM search_entry'
+        ' JOIN node ON node.id = search_entry.rowid / 2'
+        ' WHERE search_entry MATCH :query AND search_entry.rowid % 2 = 1'
+        ' ORDER BY search_entry.rank, node.id DESC'
+        ' LIMIT :limit OFFSET :offset')
+    match_term = '"{}"*'
+    match_operator = ' OR '
+
+
+class PostgresBackend(DatabaseBackend):
+    """search_entry holds weighted tsvectors under a GIN index, ranked
+    with ts_rank."""
+    create_statements = (
+        'CREATE TABLE IF NOT EXISTS search_entry ('
+        'id BIGINT PRIMARY KEY, project_id INTEGER NOT NULL, '
+        'document TSVECTOR NOT NULL)',
+        'CREATE INDEX IF NOT EXISTS ix_search_entry_document '
+        'ON search_entry USING GIN (document)',
+        'CREATE INDEX IF NOT EXISTS ix_search_entry_project_id '
+        'ON search_entry (project_id)',
+    )
+    drop_statements = ('DROP TABLE IF EXISTS search_entry',)
+    upsert_statements = (
+        'INSERT INTO search_entry (id, project_id, document) '
+        "VALUES (:id, :project_id, setweight(to_tsvector('simple', :text), "
+        'CAST(:weight AS "char"))) '
+        'ON CONFLICT (id) DO UPDATE SET project_id = excluded.project_id, '
+        'document = excluded.document',
+    )
+    project_query = (
+        'SELECT project.id, count(*) OVER () FROM ('
+        " SELECT project_id, max(ts_rank(document,"
+        "  to_tsquery('simple', :query))) AS score"
+        " FROM search_entry WHERE document @@ to_tsquery('simple', :query)"
+        ' GROUP BY project_id) AS hit'
+        ' JOIN project ON project.id = hit.project_id'
+        ' ORDER BY hit.score DESC, project.id DESC'
+        ' LIMIT :limit OFFSET :offset')
+    node_query = (
+        'SELECT node.id, count(*) OVER () FROM search_entry'
+        ' JOIN node ON node.id = search_entry.id / 2'
+        " WHERE document @@ to_tsquery('simple', :query)"
+        ' AND search_entry.id % 2 = 1'
+        " ORDER BY ts_rank(document, to_tsquery('simple', :query)) DESC,"
+        ' node.id DESC LIMIT :limit OFFSET :offset')
+    match_term = '{}:*'
+    match_operator = ' | '
+
+
+DATABASE_BACKENDS = {'sqlite': SQLiteBackend, 'postgresql': PostgresBackend}
+
+
+def create_backend(app, engine):
+    """Return the backend selected by SEARCH_BACKEND: 'elasticsearch'
+    or 'database'. Without a setting Elasticsearch is used when
+    ELASTICSEARCH_URL is configured."""
+    name = app.config['SEARCH_BACKEND'] or (
+        'elasticsearch' if app.elasticsearch else 'database')
+    if name == 'elasticsearch':
+        queue = IndexingQueue(
+            app.elasticsearch, maxsize=app.config['SEARCH_QUEUE_SIZE'],
+            batch_size=app.config['SEARCH_BATCH_SIZE'],
+            interval=app.config['SEARCH_FLUSH_INTERVAL'],
+            retries=app.config['SEARCH_RETRIES'], logger=app.logger)
+        atexit.register(queue.close)
+        return ElasticsearchBackend(app.elasticsearch, queue)
+    if name != 'database':
+        raise ValueError('Unknown search backend {}'.format(name))
+    return DATABASE_BACKENDS.get(engine.dialect.name, NullBackend)()
+
+
+def is_search_table(name):
+    """Whether name is search_entry or one of the shadow tables of
+    its FTS5 index, which are not part of the metadata."""
+    return name == 'search_entry' or name.startswith('search_entry_')
+
+
+def create_tables(target, connection, **kw):
+    """Create the search_entry table of the database backend of
+    connection, used with db.create_all."""
+    backend = DATABASE_BACKENDS.get(connection.dialect.name, NullBackend)
+    for statement in getattr(backend, 'create_statements', ()):
+        connection.execute(text(statement))
+
+
+def drop_tables(target, connection, **kw):
+    backend = DATABASE_BACKENDS.get(connection.dialect.name, NullBackend)
+    for statement in getattr(backend, 'drop_statements', ()):
+        connection.execute(text(statement))
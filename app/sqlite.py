@@ -0,0 +1,34 @@
+"""Connection settings for SQLite deployments."""
+from sqlalchemy import event
+
+# config key, pragma
+PRAGMAS = (
+    ('SQLITE_JOURNAL_MODE', 'journal_mode'),
+    ('SQLITE_SYNCHRONOUS', 'synchronous'),
+    ('SQLITE_MMAP_SIZE', 'mmap_size'),
+    ('SQLITE_CACHE_SIZE', 'cache_size'),
+    ('SQLITE_BUSY_TIMEOUT', 'busy_timeout'),
+    ('SQLITE_FOREIGN_KEYS', 'foreign_keys'),
+)
+
+
+def configure_sqlite(engine, config):
+    """Run the SQLITE_* pragmas of config on every new connection of a
+    SQLite engine. Settings that are None are left at the default."""
+    if engine.url.drivername != 'sqlite':
+        return
+    pragmas = ['PRAGMA {}={}'.format(pragma, _literal(config[key]))
+               for key, pragma in PRAGMAS if config.get(key) is not None]
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for statement in pragmas:
+            cursor.execute(statement)
+        cursor.close()
+
+
+def _literal(value):
+    if isinstance(value, bool):
+        return 'ON' if value else 'OFF'
+    return value
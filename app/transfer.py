@@ -0,0 +1,187 @@
+"""Streaming import and export of project graphs.
+
+A graph is a sequence of records, one per line in JSON Lines and one
+per row in CSV (columns type, id, name, source, sink):
+
+    {"type": "node", "id": "<external id>", "name": "..."}
+    {"type": "edge", "source": "<external id>", "sink": "<external id>"}
+"""
+import csv
+import io
+import json
+from itertools import islice
+from app import db
+from app.models import Edge, Node
+
+FORMATS = ('jsonl', 'csv')
+MIMETYPES = {'jsonl': 'application/x-ndjson', 'csv': 'text/csv'}
+CSV_FIELDS = ['type', 'id', 'name', 'source', 'sink']
+
+
+def read_records(lines, format):
+    """Yield the records of an iterable of text lines."""
+    if format == 'csv':
+        for row in csv.DictReader(lines):
+            yield {key: value for key, value in row.items() if value}
+    elif format == 'jsonl':
+        for number, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                raise ValueError('Line {} is not valid JSON'.format(number))
+    else:
+        raise ValueError('Unknown format {}'.format(format))
+
+
+def write_records(records, format):
+    """Yield the records as lines of text."""
+    if format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, CSV_FIELDS, lineterminator='\n')
+
+        def drain():
+            line = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            return line
+        writer.writeheader()
+        yield drain()
+        for record in records:
+            writer.writerow(record)
+            yield drain()
+    elif format == 'jsonl':
+        for record in records:
+            yield json.dumps(record) + '\n'
+    else:
+        raise ValueError('Unknown format {}'.format(format))
+
+
+def export_records(project, chunk_size=1000):
+    """Yield the nodes and then the edges of project. Rows are fetched
+    chunk_size at a time, so memory does not grow with the project.
+    Nodes without an external id are exported under their id. Edges
+    into other projects are left out, their sinks are not exported."""
+    nodes = (db.session.query(_external_id(Node), Node.name)
+             .filter(Node.project_id == project.id)
+             .order_by(Node.id).yield_per(chunk_size))
+    for node_id, name in nodes:
+        yield {'type': 'node', 'id': node_id, 'name': name}
+    source, sink = db.aliased(Node), db.aliased(Node)
+    edges = (db.session.query(_external_id(source), _external_id(sink))
+             .select_from(Edge)
+             .join(source, Edge.source_id == source.id)
+             .join(sink, Edge.sink_id == sink.id)
+             .filter(Edge.project_id == project.id,
+                     sink.project_id == project.id)
+             .order_by(Edge.id).yield_per(chunk_size))
+    for source_id, sink_id in edges:
+        yield {'type': 'edge', 'source': source_id, 'sink': sink_id}
+
+
+def import_records(project, records, creator=None, chunk_size=1000):
+    """Add the nodes and edges of records to project. Nodes are
+    inserted chunk_size at a time, with COPY on PostgreSQL and an
+    executemany insert elsewhere. Nodes whose external id already exists
+    in the project, or that are exported under the id of one of its
+    nodes, are skipped, so an import can be repeated. Edges are
+    collected and added with Project.connect_many once all nodes exist.
+    Raises ValueError for malformed records and CycleError if the
+    edges would create a cycle. Returns (nodes, edges) added."""
+    known = set(_node_ids(project))
+    creator_id = creator.id if creator is not None else None
+    pairs = []
+
+    def node_rows():
+        for number, record in enumerate(records, 1):
+            if not isinstance(record, dict):
+                raise ValueError('Record {} is not an object'.format(number))
+            kind = record.get('type')
+            if kind == 'edge':
+                source = _text(record, 'source', number)
+                sink = _text(record, 'sink', number)
+                if source is None or sink is None:
+                    raise ValueError('Record {} has no {}'.format(
+                        number, 'source' if source is None else 'sink'))
+                pairs.append((source, sink))
+            elif kind == 'node':
+                external_id = _text(record, 'id', number)
+                if external_id is None:
+                    raise ValueError('Record {} has no id'.format(number))
+                if external_id in known:
+                    continue
+                known.add(external_id)
+                yield {'project_id': project.id,
+                       'name': _text(record, 'name', number) or external_id,
+                       'external_id': external_id,
+                       'creator_id': creator_id,
+                       'component_rank': 0}
+            else:
+                raise ValueError('Record {} has unknown type {!r}'
+                                 .format(number, kind))
+
+    insert = (_copy_nodes if db.engine.dialect.name == 'postgresql'
+              else _insert_nodes)
+    rows, added = node_rows(), 0
+    chunk = list(islice(rows, chunk_size))
+    while chunk:
+        insert(chunk)
+        added += len(chunk)
+        # bulk inserts bypass the session events that keep the
+        # search index up to date
+        Node.update_index(db.session, added=Node.query.filter(
+            Node.project_id == project.id,
+            Node.external_id.in_([row['external_id'] for row in chunk])))
+        chunk = list(islice(rows, chunk_size))
+    if added:
+        project.bump_revision()
+
+    ids = _node_ids(project)
+    missing = {i for pair in pairs for i in pair} - set(ids)
+    if missing:
+        raise ValueError('Unknown nodes {}'.format(sorted(missing)))
+    connected = project.connect_many(
+        (ids[source], ids[sink]) for source, sink in pairs)
+    return added, connected
+
+
+def _external_id(node):
+    """The id of node (Node or an alias) in exported graphs: its
+    external id or else its id."""
+    return db.func.coalesce(node.external_id, db.cast(node.id, db.String))
+
+
+def _node_ids(project):
+    """Map the exported ids of the nodes of project to their ids."""
+    return dict(db.session.query(_external_id(Node), Node.id)
+                .filter(Node.project_id == project.id))
+
+
+def _text(record, field, number):
+    """Return a field of record as a string, None if it is missing.
+    Raises ValueError unless it is a string or a number."""
+    value = record.get(field)
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError('Record {} has an invalid {}'.format(number, field))
+    return str(value)
+
+
+def _insert_nodes(rows):
+    db.session.execute(Node.__table__.insert(), rows)
+
+
+def _copy_nodes(rows):
+    columns = ['project_id', 'name', 'external_id', 'creator_id',
+               'component_rank']
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow(['' if row[c] is None else row[c] for c in columns])
+    buffer.seek(0)
+    cursor = db.session.connection().connection.cursor()
+    cursor.copy_expert('COPY node ({}) FROM STDIN WITH (FORMAT csv)'
+                       .format(', '.join(columns)), buffer)
+    cursor.close()
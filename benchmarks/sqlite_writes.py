@@ -0,0 +1,97 @@
+"""Concurrent write throughput of SQLite with and without the pragmas
+of Config, with one process per simulated gunicorn worker.
+
+    python benchmarks/sqlite_writes.py --workers 4 --seconds 10
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir))
+
+from sqlalchemy.exc import OperationalError  # noqa: E402
+from app import create_app, db  # noqa: E402
+from app.models import User, Project, Node  # noqa: E402
+from config import Config  # noqa: E402
+
+
+def make_config(path, tuned):
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + path
+        ELASTICSEARCH_URL = None
+        TESTING = True
+    if not tuned:
+        for key in ('SQLITE_JOURNAL_MODE', 'SQLITE_SYNCHRONOUS',
+                    'SQLITE_MMAP_SIZE', 'SQLITE_CACHE_SIZE',
+                    'SQLITE_BUSY_TIMEOUT', 'SQLITE_FOREIGN_KEYS'):
+            setattr(BenchmarkConfig, key, None)
+    return BenchmarkConfig
+
+
+def worker(config, project_id, user_id, seconds, results):
+    """Add nodes, one transaction each, like the node form does, and
+    update last_seen of the user in between."""
+    app = create_app(config)
+    writes = errors = 0
+    try:
+        with app.app_context():
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                try:
+                    db.session.add(Node(name='node', project_id=project_id,
+                                        creator_id=user_id))
+                    db.session.commit()
+                    User.query.filter_by(id=user_id).update(
+                        {'last_seen': datetime.utcnow()})
+                    db.session.commit()
+                    writes += 2
+                except OperationalError:
+                    db.session.rollback()
+                    errors += 1
+    finally:
+        results.put((writes, errors))
+
+
+def run(workers, seconds, tuned):
+    directory = tempfile.mkdtemp()
+    config = make_config(os.path.join(directory, 'benchmark.db'), tuned)
+    app = create_app(config)
+    with app.app_context():
+        db.create_all()
+        user = User(username='benchmark', email='benchmark@example.com')
+        project = Project(name='benchmark', created_by=user)
+        db.session.add_all([user, project])
+        db.session.commit()
+        ids = project.id, user.id
+        db.engine.dispose()
+    results = Queue()
+    processes = [Process(target=worker,
+                         args=(config,) + ids + (seconds, results))
+                 for _ in range(workers)]
+    for process in processes:
+        process.start()
+    totals = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    writes = sum(w for w, _ in totals)
+    errors = sum(e for _, e in totals)
+    return writes / seconds, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+    for label, tuned in (('default', False), ('tuned', True)):
+        rate, errors = run(args.workers, args.seconds, tuned)
+        print('{:8} {:2} workers: {:8.1f} writes/s, {} lock errors'
+              .format(label, args.workers, rate, errors))
+
+
+if __name__ == '__main__':
+    main()
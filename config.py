@@ -10,12 +10,69 @@ class Config(object):
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'app.db')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # pragmas run on every new SQLite connection, None keeps the default
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    SQLITE_MMAP_SIZE = int(os.environ.get('SQLITE_MMAP_SIZE') or 256 * 2**20)
+    # negative sizes are in KiB
+    SQLITE_CACHE_SIZE = int(os.environ.get('SQLITE_CACHE_SIZE') or -64 * 2**10)
+    SQLITE_BUSY_TIMEOUT = int(os.environ.get('SQLITE_BUSY_TIMEOUT') or 5000)
+    SQLITE_FOREIGN_KEYS = True
+    # optional read replica used by the views marked read_only
+    DATABASE_REPLICA_URL = os.environ.get('DATABASE_REPLICA_URL')
+    SQLALCHEMY_BINDS = ({'replica': DATABASE_REPLICA_URL}
+                        if DATABASE_REPLICA_URL else {})
+    # seconds a browser session reads from the primary after a write
+    REPLICA_READ_AFTER_WRITE = int(
+        os.environ.get('REPLICA_READ_AFTER_WRITE') or 5)
+    # pool options, only passed to the engines when set
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        option: int(os.environ[name]) for option, name in (
+            ('pool_size', 'DATABASE_POOL_SIZE'),
+            ('max_overflow', 'DATABASE_MAX_OVERFLOW'),
+            ('pool_timeout', 'DATABASE_POOL_TIMEOUT'),
+            ('pool_recycle', 'DATABASE_POOL_RECYCLE'))
+        if os.environ.get(name)}
     LOG_TO_STDOUT = os.environ.get('LOG_TO_STDOUT')
     MAIL_SERVER = os.environ.get('MAIL_SERVER')
     MAIL_PORT = int(os.environ.get('MAIL_PORT') or 25)
     MAIL_USE_TLS = os.environ.get('MAIL_USE_TLS') is not None
     MAIL_USERNAME = os.environ.get('MAIL_USERNAME')
     MAIL_PASSWORD = os.environ.get('MAIL_PASSWORD')
+    MAIL_WORKERS = int(os.environ.get('MAIL_WORKERS') or 2)
+    MAIL_QUEUE_SIZE = int(os.environ.get('MAIL_QUEUE_SIZE') or 1000)
+    MAIL_ENQUEUE_TIMEOUT = int(os.environ.get('MAIL_ENQUEUE_TIMEOUT') or 5)
+    MAIL_BATCH_SIZE = int(os.environ.get('MAIL_BATCH_SIZE') or 50)
+    MAIL_RETRIES = int(os.environ.get('MAIL_RETRIES') or 3)
+    MAIL_RETRY_DELAY = int(os.environ.get('MAIL_RETRY_DELAY') or 1)
+    MAIL_CLOSE_TIMEOUT = int(os.environ.get('MAIL_CLOSE_TIMEOUT') or 30)
     ADMINS = []
     ELASTICSEARCH_URL = os.environ.get('ELASTICSEARCH_URL')
+    # 'elasticsearch' or 'database', by default Elasticsearch is used
+    # when ELASTICSEARCH_URL is set
+    SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND')
+    # Elasticsearch updates are queued and sent in bulk requests of up
+    # to SEARCH_BATCH_SIZE actions at least every SEARCH_FLUSH_INTERVAL
+    # seconds
+    SEARCH_QUEUE_SIZE = int(os.environ.get('SEARCH_QUEUE_SIZE') or 10000)
+    SEARCH_BATCH_SIZE = int(os.environ.get('SEARCH_BATCH_SIZE') or 500)
+    SEARCH_FLUSH_INTERVAL = float(
+        os.environ.get('SEARCH_FLUSH_INTERVAL') or 1.0)
+    SEARCH_RETRIES = int(os.environ.get('SEARCH_RETRIES') or 5)
     PROJECTS_PER_PAGE = 25
+    # rows per statement when importing or exporting project graphs
+    TRANSFER_CHUNK_SIZE = int(os.environ.get('TRANSFER_CHUNK_SIZE') or 1000)
+    # seconds or number of users before last seen times are written
+    LAST_SEEN_FLUSH_INTERVAL = int(os.environ.get('LAST_SEEN_FLUSH_INTERVAL') or 60)
+    LAST_SEEN_FLUSH_SIZE = int(os.environ.get('LAST_SEEN_FLUSH_SIZE') or 100)
+    ANALYSIS_CACHE_SIZE = int(os.environ.get('ANALYSIS_CACHE_SIZE') or 128)
+    # the redundant edges need the transitive closure, one bit per pair
+    # of nodes, it is skipped for larger projects
+    ANALYSIS_MAX_CLOSURE_NODES = int(
+        os.environ.get('ANALYSIS_MAX_CLOSURE_NODES') or 5000)
+    # the user cache is per process, after a profile change the other
+    # processes serve the old user for up to USER_CACHE_TTL seconds
+    USER_CACHE_SIZE = int(os.environ.get('USER_CACHE_SIZE') or 1024)
+    USER_CACHE_TTL = int(os.environ.get('USER_CACHE_TTL') or 300)
+    # seconds between log lines with the hit and miss counters of the caches
+    CACHE_LOG_INTERVAL = int(os.environ.get('CACHE_LOG_INTERVAL') or 3600)
@@ -0,0 +1,36 @@
+"""weak component index
+
+Revision ID: 3b8e5c2d9a41
+Revises: ff4d5aa360e6
+Create Date: 2026-10-18 10:12:31.118402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e5c2d9a41'
+down_revision = 'ff4d5aa360e6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('node', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('component_parent_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('component_rank', sa.Integer(), nullable=True))
+
+    # existing projects build their index on the next analysis
+    with op.batch_alter_table('project', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('components_stale', sa.Boolean(), nullable=True,
+                                      server_default=sa.true()))
+
+
+def downgrade():
+    with op.batch_alter_table('project', schema=None) as batch_op:
+        batch_op.drop_column('components_stale')
+
+    with op.batch_alter_table('node', schema=None) as batch_op:
+        batch_op.drop_column('component_rank')
+        batch_op.drop_column('component_parent_id')
@@ -0,0 +1,70 @@
+"""on delete cascade
+
+Revision ID: 5f2c8b7d3e90
+Revises: e7a93d4b1c68
+Create Date: 2026-10-18 14:35:10.942356
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2c8b7d3e90'
+down_revision = 'e7a93d4b1c68'
+branch_labels = None
+depends_on = None
+
+# names unnamed foreign keys when SQLite tables are recreated
+naming_convention = {
+    'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s',
+}
+
+foreign_keys = {
+    'edge': [('source_id', 'node'), ('sink_id', 'node'),
+             ('project_id', 'project')],
+    'node': [('project_id', 'project')],
+}
+
+# options and expression indexes the reflection does not recover when
+# SQLite recreates a table
+table_kwargs = {
+    'node': {'sqlite_autoincrement': True},
+}
+expression_indexes = {
+    'node': [('ix_node_project_id_order_key',
+              ['project_id', 'coalesce(topo_order, id)'])],
+}
+
+
+def _replace_foreign_keys(ondelete):
+    inspector = sa.inspect(op.get_bind())
+    for table, columns in foreign_keys.items():
+        existing = {}
+        for fk in inspector.get_foreign_keys(table):
+            column = fk['constrained_columns'][0]
+            existing[column] = fk['name'] or naming_convention['fk'] % {
+                'table_name': table,
+                'column_0_name': column,
+                'referred_table_name': fk['referred_table']}
+        with op.batch_alter_table(table, schema=None,
+                                  naming_convention=naming_convention,
+                                  table_kwargs=table_kwargs.get(table, {})) \
+                as batch_op:
+            for column, referred in columns:
+                name = 'fk_{}_{}_{}'.format(table, column, referred)
+                batch_op.drop_constraint(existing[column], type_='foreignkey')
+                batch_op.create_foreign_key(name, referred, [column], ['id'],
+                                            ondelete=ondelete)
+        if op.get_bind().dialect.name == 'sqlite':
+            for name, columns in expression_indexes.get(table, []):
+                op.create_index(name, table,
+                                [sa.text(column) for column in columns])
+
+
+def upgrade():
+    _replace_foreign_keys(ondelete='CASCADE')
+
+
+def downgrade():
+    _replace_foreign_keys(ondelete=None)
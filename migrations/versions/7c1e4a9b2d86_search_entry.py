@@ -0,0 +1,52 @@
+"""search entry
+
+Revision ID: 7c1e4a9b2d86
+Revises: d3b6f1e8a725
+Create Date: 2026-10-18 17:20:44.106385
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '7c1e4a9b2d86'
+down_revision = 'd3b6f1e8a725'
+branch_labels = None
+depends_on = None
+
+# full-text index of project and node names, see app/search.py
+statements = {
+    'sqlite': [
+        "CREATE VIRTUAL TABLE search_entry USING "
+        "fts5(text, project_id UNINDEXED, prefix='2 3')",
+        "INSERT INTO search_entry (rowid, text, project_id) "
+        "SELECT 2 * id, coalesce(name, ''), id FROM project",
+        "INSERT INTO search_entry (rowid, text, project_id) "
+        "SELECT 2 * id + 1, coalesce(name, ''), project_id FROM node "
+        "WHERE project_id IS NOT NULL",
+    ],
+    'postgresql': [
+        "CREATE TABLE search_entry (id BIGINT PRIMARY KEY, "
+        "project_id INTEGER NOT NULL, document TSVECTOR NOT NULL)",
+        "INSERT INTO search_entry (id, project_id, document) "
+        "SELECT 2 * id, id, setweight(to_tsvector('simple', "
+        "coalesce(name, '')), 'A') FROM project",
+        "INSERT INTO search_entry (id, project_id, document) "
+        "SELECT 2 * id + 1, project_id, setweight(to_tsvector('simple', "
+        "coalesce(name, '')), 'B') FROM node WHERE project_id IS NOT NULL",
+        "CREATE INDEX ix_search_entry_document "
+        "ON search_entry USING GIN (document)",
+        "CREATE INDEX ix_search_entry_project_id "
+        "ON search_entry (project_id)",
+    ],
+}
+
+
+def upgrade():
+    for statement in statements.get(op.get_bind().dialect.name, []):
+        op.execute(statement)
+
+
+def downgrade():
+    if op.get_bind().dialect.name in statements:
+        op.execute('DROP TABLE search_entry')
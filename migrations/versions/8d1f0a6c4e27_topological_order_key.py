@@ -0,0 +1,61 @@
+"""topological order key
+
+Revision ID: 8d1f0a6c4e27
+Revises: 3b8e5c2d9a41
+Create Date: 2026-10-18 11:02:47.530219
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d1f0a6c4e27'
+down_revision = '3b8e5c2d9a41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # without AUTOINCREMENT SQLite reuses the id of a deleted last node,
+    # which can be the order key of another node
+    sqlite = op.get_bind().dialect.name == 'sqlite'
+    with op.batch_alter_table('node', schema=None,
+                              recreate='always' if sqlite else 'auto',
+                              table_kwargs={'sqlite_autoincrement': True}) \
+            as batch_op:
+        batch_op.add_column(sa.Column('topo_order', sa.Integer(), nullable=True))
+        batch_op.create_index(batch_op.f('ix_node_topo_order'), ['topo_order'], unique=False)
+
+    # Existing edges may point from newer to older nodes, so the default
+    # key (the node id) is not a valid order yet. Assign the sorted ids
+    # in topological order (Kahn), nodes on a cycle go last.
+    connection = op.get_bind()
+    node_ids = [row[0] for row in connection.execute(
+        sa.text('SELECT id FROM node ORDER BY id'))]
+    sinks = {node_id: [] for node_id in node_ids}
+    indegree = dict.fromkeys(node_ids, 0)
+    for source_id, sink_id in connection.execute(
+            sa.text('SELECT source_id, sink_id FROM edge')):
+        if source_id in sinks and sink_id in indegree:
+            sinks[source_id].append(sink_id)
+            indegree[sink_id] += 1
+    order = [node_id for node_id in node_ids if indegree[node_id] == 0]
+    for node_id in order:
+        for sink_id in sinks[node_id]:
+            indegree[sink_id] -= 1
+            if indegree[sink_id] == 0:
+                order.append(sink_id)
+    placed = set(order)
+    order += [node_id for node_id in node_ids if node_id not in placed]
+    update = sa.text('UPDATE node SET topo_order = :key WHERE id = :id')
+    moved = [{'id': node_id, 'key': key}
+             for node_id, key in zip(order, node_ids) if node_id != key]
+    if moved:
+        connection.execute(update, moved)
+
+
+def downgrade():
+    with op.batch_alter_table('node', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_node_topo_order'))
+        batch_op.drop_column('topo_order')
@@ -0,0 +1,32 @@
+"""order key index
+
+Revision ID: c4d7e9f1a2b5
+Revises: 8d1f0a6c4e27
+Create Date: 2026-10-18 19:12:40.583906
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4d7e9f1a2b5'
+down_revision = '8d1f0a6c4e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the queries compare coalesce(topo_order, id), which cannot use
+    # an index on the bare column
+    with op.batch_alter_table('node', schema=None) as batch_op:
+        batch_op.drop_index('ix_node_topo_order')
+    op.create_index('ix_node_project_id_order_key', 'node',
+                    ['project_id', sa.text('coalesce(topo_order, id)')],
+                    unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_node_project_id_order_key', table_name='node')
+    with op.batch_alter_table('node', schema=None) as batch_op:
+        batch_op.create_index('ix_node_topo_order', ['topo_order'], unique=False)
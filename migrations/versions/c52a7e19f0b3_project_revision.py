@@ -0,0 +1,27 @@
+"""project revision
+
+Revision ID: c52a7e19f0b3
+Revises: c4d7e9f1a2b5
+Create Date: 2026-10-18 12:20:05.614870
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c52a7e19f0b3'
+down_revision = 'c4d7e9f1a2b5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('project', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('revision', sa.Integer(), nullable=False,
+                                      server_default='0'))
+
+
+def downgrade():
+    with op.batch_alter_table('project', schema=None) as batch_op:
+        batch_op.drop_column('revision')
@@ -0,0 +1,46 @@
+"""edge indexes and project id
+
+Revision ID: e7a93d4b1c68
+Revises: c52a7e19f0b3
+Create Date: 2026-10-18 13:41:52.207731
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a93d4b1c68'
+down_revision = 'c52a7e19f0b3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('edge', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('project_id', sa.Integer(), nullable=True))
+
+    op.execute('UPDATE edge SET project_id = '
+               '(SELECT node.project_id FROM node WHERE node.id = edge.source_id)')
+    # keep the oldest of duplicate edges before adding the constraint
+    op.execute('DELETE FROM edge WHERE id NOT IN '
+               '(SELECT MIN(id) FROM edge GROUP BY source_id, sink_id)')
+
+    with op.batch_alter_table('edge', schema=None) as batch_op:
+        batch_op.create_foreign_key('fk_edge_project_id_project', 'project',
+                                    ['project_id'], ['id'])
+        batch_op.create_unique_constraint('uq_edge_source_id_sink_id',
+                                          ['source_id', 'sink_id'])
+        batch_op.create_index('ix_edge_sink_id_source_id',
+                              ['sink_id', 'source_id'], unique=False)
+        batch_op.create_index('ix_edge_project_id_source_id_sink_id',
+                              ['project_id', 'source_id', 'sink_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('edge', schema=None) as batch_op:
+        batch_op.drop_index('ix_edge_project_id_source_id_sink_id')
+        batch_op.drop_index('ix_edge_sink_id_source_id')
+        batch_op.drop_constraint('uq_edge_source_id_sink_id', type_='unique')
+        batch_op.drop_constraint('fk_edge_project_id_project', type_='foreignkey')
+        batch_op.drop_column('project_id')
@@ -1,8 +1,25 @@
 """Unittests for tawachai"""
+import logging
+import os
+import tempfile
+import threading
 import unittest
-from app import create_app, db
+import warnings
+from contextlib import contextmanager
+from sqlalchemy.exc import IntegrityError
+from datetime import datetime, timedelta
+from app import create_app, db, last_seen, mail_worker
+from app.email import send_email
+from flask_mail import Message
 from app.models import User, Project, Node, Edge
-from app.graphs import Graph
+from app.graphs import Graph, CompactGraph, CycleError
+from app.cache import LRUCache
+from app.pagination import keyset_paginate, decode_cursor
+from app.search import ElasticsearchBackend, IndexingQueue
+from app.reindex import reindex
+from app import cli
+from app.transfer import (export_records, import_records, read_records,
+                          write_records)
 from config import Config
 
 
@@ -12,6 +29,39 @@ class TestConfig(Config):
     SQLALCHEMY_DATABASE_URI = 'sqlite://'
 
 
+class FakeElasticsearch():
+    """Records bulk requests, failing the first `fail` ones and
+    answering 429 for the ids in `reject` once."""
+    def __init__(self, fail=0, reject=()):
+        self.fail = fail
+        self.reject = set(reject)
+        self.requests = []
+        self.documents = {}
+
+    def bulk(self, body):
+        self.requests.append(body)
+        if self.fail:
+            self.fail -= 1
+            raise ConnectionError('unavailable')
+        items, lines = [], iter(body)
+        for line in lines:
+            (op, meta), = line.items()
+            key = meta['_index'], meta['_id']
+            if meta['_id'] in self.reject:
+                self.reject.discard(meta['_id'])
+                status = 429
+            elif op == 'index':
+                self.documents[key] = next(lines)
+                status = 200
+            else:
+                status = 200 if self.documents.pop(key, None) else 404
+            if op == 'index' and status == 429:
+                next(lines)
+            items.append({op: {'status': status}})
+        return {'errors': any(item[op]['status'] >= 400 for item in items
+                              for op in item), 'items': items}
+
+
 class UserModelCase(unittest.TestCase):
     """Set up the Test cases"""
     def setUp(self):
@@ -21,10 +71,24 @@ class UserModelCase(unittest.TestCase):
         db.create_all()
 
     def tearDown(self):
+        last_seen.flush()
         db.session.remove()
         db.drop_all()
         self.app_context.pop()
 
+    @contextmanager
+    def count_statements(self):
+        """Collect the SQL statements executed inside the block."""
+        statements = []
+
+        def count(conn, cursor, statement, parameters, context, many):
+            statements.append(statement)
+        db.event.listen(db.engine, 'before_cursor_execute', count)
+        try:
+            yield statements
+        finally:
+            db.event.remove(db.engine, 'before_cursor_execute', count)
+
     def test_password_hashing(self):
         user = User(username='susan')
         user.set_password('cat')
@@ -169,13 +233,823 @@ class UserModelCase(unittest.TestCase):
         n1.add_sink(n0)
         n1.add_source(n2)
         db.session.commit()
-        self.assertEqual(p.nodes.all(), [n0, n1, n2])
+        self.assertEqual(p.nodes.order_by(Node.id).all(), [n0, n1, n2])
         p.delete()
         db.session.commit()
         self.assertEqual(Node.query.all(), [n3])
         self.assertEqual(Edge.query.all(), [])
         self.assertEqual(Project.query.all(), [])
 
+    def test_project_graph_query_count(self):
+        p = Project(name="Test Project")
+        nodes = [Node(name="n{}".format(i), project=p) for i in range(50)]
+        db.session.add(p)
+        db.session.add_all(nodes)
+        db.session.commit()
+        for source, sink in zip(nodes, nodes[1:]):
+            source.add_sink(sink)
+        db.session.commit()
+        project_id = p.id
+        db.session.expire_all()
+        p = Project.query.get(project_id)
+
+        with self.count_statements() as statements:
+            graph = p.graph()
+
+        self.assertEqual(len(statements), 2)
+        self.assertEqual(len(graph.nodes()), 50)
+        self.assertEqual(len(graph.edges()), 49)
+        self.assertEqual([n.name for n in graph.topsort()],
+                         ["n{}".format(i) for i in range(50)])
+
+    def test_weak_component_index(self):
+        p = Project(name="Test Project")
+        n = [Node(name="n{}".format(i), project=p) for i in range(6)]
+        db.session.add(p)
+        db.session.add_all(n)
+        db.session.commit()
+
+        def components():
+            return sorted(sorted(c) for c in p.weak_components())
+        ids = [node.id for node in n]
+
+        self.assertEqual(len(components()), 6)
+        n[0].add_sink(n[1])
+        n[2].add_sink(n[1])
+        n[3].add_sink(n[4])
+        db.session.commit()
+        self.assertFalse(p.components_stale)
+        self.assertEqual(components(),
+                         [[ids[0], ids[1], ids[2]], [ids[3], ids[4]],
+                          [ids[5]]])
+        self.assertEqual(sum(node.component_parent_id is None for node in n),
+                         3)
+
+        n[2].remove_sink(n[1])
+        db.session.commit()
+        self.assertTrue(p.components_stale)
+        self.assertEqual(components(),
+                         [[ids[0], ids[1]], [ids[2]], [ids[3], ids[4]],
+                          [ids[5]]])
+        # reads do not rebuild the index, the next insertion does
+        db.session.commit()
+        self.assertTrue(p.components_stale)
+
+        n[4].add_sink(n[0])
+        db.session.commit()
+        self.assertFalse(p.components_stale)
+        self.assertEqual(components(),
+                         [[ids[0], ids[1], ids[3], ids[4]], [ids[2]],
+                          [ids[5]]])
+
+    def test_topological_order(self):
+        p = Project(name="Test Project")
+        n = [Node(name="n{}".format(i), project=p) for i in range(5)]
+        db.session.add(p)
+        db.session.add_all(n)
+        db.session.commit()
+
+        # n4 --> n3 --> n2 --> n1 --> n0, inserted against the id order
+        n[4].add_sink(n[3])
+        n[1].add_sink(n[0])
+        n[3].add_sink(n[2])
+        n[2].add_sink(n[1])
+        db.session.commit()
+        self.assertEqual(p.topological_order().all(), n[::-1])
+        for node in n[1:]:
+            for sink in node.sinks():
+                self.assertLess(node.order_key, sink.order_key)
+
+        with self.assertRaises(CycleError) as context:
+            n[0].add_sink(n[4])
+        self.assertEqual(context.exception.cycle, n[::-1])
+        db.session.commit()
+        self.assertEqual(n[0].sinks(), [])
+        self.assertEqual(p.topological_order().all(), n[::-1])
+
+        # n0 took the key of n4, a new node must not get it again
+        db.session.delete(n[4])
+        db.session.commit()
+        node = Node(name="n5", project=p)
+        db.session.add(node)
+        db.session.commit()
+        self.assertNotIn(node.order_key, [m.order_key for m in n[:4]])
+
+    def test_reaches(self):
+        n = [Node(name="n{}".format(i)) for i in range(6)]
+        db.session.add_all(n)
+        db.session.commit()
+        for source, sink in zip(n[1:], n):
+            source.add_sink(sink)
+        db.session.commit()
+
+        self.assertTrue(n[5].reaches(n[0]))
+        self.assertTrue(n[5].reaches(n[0], max_depth=5))
+        self.assertFalse(n[5].reaches(n[0], max_depth=4))
+        self.assertFalse(n[0].reaches(n[5]))
+        with self.assertRaises(CycleError):
+            n[0].add_sink(n[5])
+        with self.assertRaises(CycleError):
+            n[2].add_source(n[0])
+        n[0].add_source(n[5])
+        db.session.commit()
+        self.assertEqual(n[5].edges_sinks.count(), 2)
+
+    def test_project_revision(self):
+        p = Project(name="Test Project")
+        n0 = Node(name="n0", project=p)
+        db.session.add_all([p, n0])
+        db.session.commit()
+        revision = p.revision
+
+        n1 = Node(name="n1", project=p)
+        db.session.commit()
+        self.assertEqual(p.revision, revision + 1)
+        n0.add_sink(n1)
+        db.session.commit()
+        self.assertEqual(p.revision, revision + 2)
+        n0.remove_sink(n1)
+        db.session.commit()
+        self.assertEqual(p.revision, revision + 3)
+        p.name = "Renamed Project"
+        db.session.commit()
+        self.assertEqual(p.revision, revision + 3)
+        n1.delete()
+        db.session.commit()
+        self.assertEqual(p.revision, revision + 4)
+
+    def test_analysis_cache(self):
+        p = Project(name="Test Project")
+        n0 = Node(name="n0", project=p)
+        n1 = Node(name="n1", project=p)
+        db.session.add_all([p, n0, n1])
+        db.session.commit()
+        cache = self.app.analysis_cache
+        cache.clear()
+
+        analysis = p.analysis()
+        self.assertEqual(len(analysis['weak_components']), 2)
+        self.assertEqual(set(analysis['order']), {n0.id, n1.id})
+        self.assertIs(p.analysis(), analysis)
+        self.assertEqual(cache.hits, 1)
+
+        n0.add_sink(n1)
+        db.session.commit()
+        analysis = p.analysis()
+        self.assertEqual(analysis['weak_components'], [[n0.id, n1.id]])
+        self.assertEqual(analysis['order'], [n0.id, n1.id])
+
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_edge_project_and_uniqueness(self):
+        p = Project(name="Test Project")
+        n0 = Node(name="n0", project=p)
+        n1 = Node(name="n1", project=p)
+        db.session.add_all([p, n0, n1])
+        db.session.commit()
+        n0.add_sink(n1)
+        db.session.commit()
+        self.assertEqual(Edge.query.one().project_id, p.id)
+        self.assertEqual(p.edges.count(), 1)
+
+        statement = str(p._edge_rows().statement.compile(
+            compile_kwargs={"literal_binds": True}))
+        plan = db.session.execute('EXPLAIN QUERY PLAN ' + statement)
+        self.assertIn('ix_edge_project_id_source_id_sink_id',
+                      ' '.join(str(row) for row in plan))
+
+        db.session.add(Edge(source=n0, sink=n1, project=p))
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+    def test_connect_and_disconnect_many(self):
+        p = Project(name="Test Project")
+        n = [Node(name="n{}".format(i), project=p) for i in range(200)]
+        db.session.add(p)
+        db.session.add_all(n)
+        db.session.commit()
+        ids = [node.id for node in n]
+        # a chain inserted against the id order
+        pairs = list(zip(ids[1:], ids))
+
+        with self.count_statements() as statements:
+            self.assertEqual(p.connect_many(pairs + pairs[:10]), 199)
+        db.session.commit()
+        self.assertLessEqual(len(statements), 6)
+        self.assertEqual(p.edges.count(), 199)
+        self.assertEqual(p.topological_order().all(), n[::-1])
+        self.assertEqual(len(p.weak_components()), 1)
+
+        with self.assertRaises(CycleError) as context:
+            p.connect_many([(ids[60], ids[50]), (ids[0], ids[199])])
+        self.assertEqual(context.exception.cycle[0], ids[199])
+        with self.assertRaises(ValueError):
+            p.connect_many([(ids[0], ids[0] + 1000)])
+        db.session.rollback()
+        self.assertEqual(p.edges.count(), 199)
+
+        self.assertEqual(p.disconnect_many(pairs[:100] + [(ids[0], ids[1])]),
+                         100)
+        db.session.commit()
+        self.assertEqual(p.edges.count(), 99)
+        self.assertEqual(len(p.weak_components()), 101)
+
+    def test_connect_many_across_projects(self):
+        p = Project(name="Test Project")
+        q = Project(name="Other Project")
+        a, b, c = [Node(name=name, project=p) for name in 'abc']
+        x = Node(name="x", project=q)
+        db.session.add_all([p, q, a, b, c, x])
+        db.session.commit()
+        a.add_sink(x)
+        x.add_sink(b)
+        db.session.commit()
+
+        # b -> a closes the cycle a -> x -> b through the other project
+        with self.assertRaises(CycleError) as context:
+            p.connect_many([(b.id, a.id)])
+        self.assertEqual(context.exception.cycle, [a.id, x.id, b.id])
+        db.session.rollback()
+
+        self.assertEqual(p.connect_many([(c.id, a.id)]), 1)
+        db.session.commit()
+        db.session.expire_all()
+        for edge in Edge.query:
+            self.assertLess(edge.source.order_key, edge.sink.order_key)
+        with self.assertRaises(CycleError):
+            b.add_sink(c)
+
+    def test_project_lock(self):
+        p = Project(name="Test Project")
+        n = [Node(name="n{}".format(i), project=p) for i in range(3)]
+        db.session.add_all([p] + n)
+        db.session.commit()
+        self.assertEqual([node.order_key for node in n],
+                         [node.id for node in n])
+        # another transaction reverses the order behind our back
+        db.session.execute(Node.__table__.update()
+                           .values(topo_order=100 - Node.id))
+        Project.lock([p.id])
+        self.assertEqual([node.order_key for node in n],
+                         [100 - node.id for node in n])
+
+    def test_project_edges_endpoint(self):
+        u = User(username='susan', email='susan@example.com')
+        p = Project(name="Test Project", created_by=u)
+        n = [Node(name="n{}".format(i), project=p) for i in range(3)]
+        db.session.add_all([u, p] + n)
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(u.id)
+            session['_fresh'] = True
+        url = '/project/{}/edges'.format(p.id)
+
+        response = client.post(url, json={'operations': [
+            {'op': 'connect', 'source': n[0].id, 'sink': n[1].id},
+            {'op': 'connect', 'source': n[1].id, 'sink': n[2].id}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json()['connected'], 2)
+
+        response = client.post(url, json={'operations': [
+            {'op': 'disconnect', 'source': n[0].id, 'sink': n[1].id},
+            {'op': 'connect', 'source': n[2].id, 'sink': n[0].id}]})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.get_json(),
+                         {'connected': 1, 'disconnected': 1,
+                          'revision': p.revision})
+
+        response = client.post(url, json={'operations': [
+            {'op': 'connect', 'source': n[0].id, 'sink': n[1].id}]})
+        self.assertEqual(response.status_code, 409)
+        response = client.post(url, json={'operations': [{'op': 'x'}]})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(p.edges.count(), 2)
+
+    def test_last_seen_write_behind(self):
+        self.app.config['LAST_SEEN_FLUSH_SIZE'] = 2
+        u1 = User(username='susan', email='susan@example.com')
+        u2 = User(username='john', email='john@example.com')
+        db.session.add_all([u1, u2])
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(u1.id)
+            session['_fresh'] = True
+        with self.count_statements() as statements:
+            client.get('/user/susan')
+            self.assertIn(u1.id, last_seen.pending())
+            self.assertFalse([s for s in statements
+                              if s.startswith('UPDATE')])
+
+            seen = datetime(2020, 1, 1)
+            last_seen.record(u1.id, seen)
+            last_seen.record(u2.id, seen)
+        self.assertEqual(last_seen.pending(), {})
+        self.assertEqual(len([s for s in statements
+                              if s.startswith('UPDATE')]), 1)
+        db.session.expire_all()
+        self.assertEqual(u1.last_seen, seen)
+        self.assertEqual(u2.last_seen, seen)
+
+        # a failed write is logged and kept for the next one
+        self.app.config['LAST_SEEN_FLUSH_SIZE'] = 1
+        with self.assertLogs(self.app.logger, 'ERROR'):
+            last_seen.record(u1.id, 'not a date')
+        self.assertEqual(last_seen.pending(), {u1.id: 'not a date'})
+        seen = datetime(2021, 1, 1)
+        last_seen.record(u1.id, seen)
+        self.assertEqual(last_seen.pending(), {})
+        db.session.expire_all()
+        self.assertEqual(u1.last_seen, seen)
+
+    def test_keyset_pagination(self):
+        u = User(username='susan', email='susan@example.com')
+        now = datetime.utcnow()
+        # two projects share each timestamp so the id breaks the ties
+        projects = [Project(name='p{}'.format(i), created_by=u,
+                            timestamp=now - timedelta(minutes=i // 2))
+                    for i in range(7)]
+        db.session.add_all([u] + projects)
+        db.session.commit()
+        expected = sorted(projects, key=lambda p: (p.timestamp, p.id),
+                          reverse=True)
+        timestamp, id = Project.timestamp, Project.id
+
+        page = keyset_paginate(Project.query, timestamp, id, 3)
+        self.assertEqual(page.items, expected[:3])
+        self.assertIsNone(page.prev_cursor)
+        page = keyset_paginate(Project.query, timestamp, id, 3,
+                               after=page.next_cursor)
+        self.assertEqual(page.items, expected[3:6])
+        last = keyset_paginate(Project.query, timestamp, id, 3,
+                               after=page.next_cursor)
+        self.assertEqual(last.items, expected[6:])
+        self.assertIsNone(last.next_cursor)
+        back = keyset_paginate(Project.query, timestamp, id, 3,
+                               before=last.prev_cursor)
+        self.assertEqual(back.items, expected[3:6])
+        back = keyset_paginate(Project.query, timestamp, id, 3,
+                               before=back.prev_cursor)
+        self.assertEqual(back.items, expected[:3])
+        self.assertIsNone(back.prev_cursor)
+        with self.assertRaises(ValueError):
+            decode_cursor('not a cursor')
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(u.id)
+            session['_fresh'] = True
+        self.assertEqual(client.get('/explore?after=' + page.next_cursor)
+                         .status_code, 200)
+        self.assertEqual(client.get('/explore?after=x').status_code, 400)
+
+    def test_user_cache(self):
+        now = [0]
+        cache = LRUCache(ttl=10, clock=lambda: now[0])
+        cache.set('a', 1)
+        now[0] = 9
+        self.assertEqual(cache.get('a'), 1)
+        now[0] = 10
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual((cache.info()['hits'], cache.info()['misses']),
+                         (1, 1))
+        cache = LRUCache(clock=lambda: now[0], name='test cache',
+                         logger=logging.getLogger('tests.cache'),
+                         log_interval=60)
+        with self.assertLogs('tests.cache', 'INFO') as logs:
+            cache.get('a')
+            now[0] = 70
+            cache.get('a')
+            cache.get('a')
+        self.assertEqual(logs.output, [
+            "INFO:tests.cache:test cache: {'hits': 0, 'misses': 2, "
+            "'size': 0, 'maxsize': 128}"])
+
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        u = User(username='susan', email='susan@example.com')
+        db.session.add(u)
+        db.session.commit()
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(u.id)
+            session['_fresh'] = True
+        client.get('/edit_profile')
+        misses = self.app.user_cache.misses
+        with self.count_statements() as statements:
+            client.get('/edit_profile')
+        self.assertEqual(self.app.user_cache.misses, misses)
+        self.assertFalse([s for s in statements if 'FROM user' in s])
+
+        client.post('/edit_profile', data={'username': 'sue',
+                                           'about_me': 'hi'})
+        self.assertIsNone(self.app.user_cache.get(u.id))
+        response = client.get('/edit_profile')
+        self.assertIn(b'sue', response.data)
+        self.assertEqual(self.app.user_cache.get(u.id)['about_me'], 'hi')
+        # the password hash is not cached, it is loaded when needed
+        u.set_password('cat')
+        db.session.commit()
+        self.assertNotIn('password_hash', self.app.user_cache.get(u.id))
+        db.session.remove()
+        with self.app.test_request_context():
+            user = User.from_cache(self.app.user_cache.get(u.id))
+            self.assertTrue(user.check_password('cat'))
+
+    def test_read_replica_routing(self):
+        self.app.config['WTF_CSRF_ENABLED'] = False
+        self.app.config['SQLALCHEMY_BINDS'] = {'replica': 'sqlite://'}
+        db.session.remove()
+        replica = db.get_engine(self.app, bind='replica')
+        db.Model.metadata.create_all(replica)
+        u = User(username='susan', email='susan@example.com')
+        db.session.add(u)
+        db.session.commit()
+        replica.execute(User.__table__.insert(),
+                        id=u.id, username='susan', email='susan@example.com')
+        replica.execute(Project.__table__.insert(), name='Replica Project',
+                        user_id=u.id, timestamp=datetime.utcnow(),
+                        revision=0)
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(u.id)
+            session['_fresh'] = True
+        def get(url):
+            # the test shares its app context, and so its session, with
+            # the requests, start each one with a fresh session
+            db.session.remove()
+            return client.get(url).data
+
+        self.assertIn(b'Replica Project', get('/explore'))
+        db.session.remove()
+        client.post('/index', data={'name': 'Primary Project'})
+        response = get('/explore')
+        self.assertIn(b'Primary Project', response)
+        self.assertNotIn(b'Replica Project', response)
+        with client.session_transaction() as session:
+            session.pop('read_primary_until')
+        self.assertIn(b'Replica Project', get('/explore'))
+
+    def test_replica_reads_do_not_write(self):
+        self.app.config['SQLALCHEMY_BINDS'] = {'replica': 'sqlite://'}
+        db.session.remove()
+        replica = db.get_engine(self.app, bind='replica')
+        db.Model.metadata.create_all(replica)
+        u = User(username='susan', email='susan@example.com')
+        p = Project(name="Test Project", created_by=u)
+        n = [Node(name="n{}".format(i), project=p) for i in range(3)]
+        db.session.add_all([u, p] + n)
+        db.session.commit()
+        n[0].add_sink(n[1])
+        n[1].add_sink(n[2])
+        p.components_stale = True
+        db.session.commit()
+        project_id = p.id
+        # the replica lags behind: it has the nodes but not the edges
+        replica.execute(User.__table__.insert(),
+                        id=u.id, username='susan', email='susan@example.com')
+        replica.execute(Project.__table__.insert(), id=p.id, name=p.name,
+                        user_id=u.id, timestamp=datetime.utcnow(),
+                        revision=0, components_stale=True)
+        replica.execute(Node.__table__.insert(),
+                        [{'id': node.id, 'name': node.name,
+                          'project_id': p.id} for node in n])
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(u.id)
+            session['_fresh'] = True
+        db.session.remove()
+        response = client.get('/project/{}/analyze'.format(project_id))
+        self.assertEqual(response.status_code, 200)
+        db.session.remove()
+
+        p = Project.query.get(project_id)
+        self.assertTrue(p.components_stale)
+        self.assertEqual(len(p.weak_components()), 1)
+
+    def test_sqlite_pragmas(self):
+        pragma = lambda name: db.session.execute('PRAGMA ' + name).scalar()
+        self.assertEqual(pragma('foreign_keys'), 1)
+        self.assertEqual(pragma('busy_timeout'), 5000)
+        self.assertEqual(pragma('cache_size'), -65536)
+        p = Project(name="Test Project")
+        db.session.add(p)
+        db.session.commit()
+        db.session.add(Node(name='n', project_id=p.id + 1))
+        with self.assertRaises(IntegrityError):
+            db.session.commit()
+
+    def test_import_and_export(self):
+        u = User(username='susan', email='susan@example.com')
+        p1 = Project(name="Source", created_by=u)
+        p2 = Project(name="Target", created_by=u)
+        db.session.add_all([u, p1, p2])
+        db.session.commit()
+        lines = ['{"type": "node", "id": "a", "name": "Design"}\n',
+                 '{"type": "edge", "source": "a", "sink": "b"}\n',
+                 '{"type": "node", "id": "b", "name": "Build"}\n',
+                 '{"type": "node", "id": "c"}\n',
+                 '{"type": "edge", "source": "b", "sink": "c"}\n']
+        self.assertEqual(import_records(p1, read_records(lines, 'jsonl'),
+                                        chunk_size=2), (3, 2))
+        db.session.commit()
+        self.assertEqual([n.name for n in p1.topological_order()],
+                         ['Design', 'Build', 'c'])
+        # repeating the import adds nothing
+        self.assertEqual(import_records(p1, read_records(lines, 'jsonl')),
+                         (0, 0))
+
+        csv = list(write_records(export_records(p1, chunk_size=2), 'csv'))
+        self.assertEqual(csv[0], 'type,id,name,source,sink\n')
+        self.assertEqual(len(csv), 6)
+        self.assertEqual(import_records(p2, read_records(csv, 'csv')),
+                         (3, 2))
+        db.session.commit()
+        self.assertEqual(list(export_records(p2)), list(export_records(p1)))
+
+        with self.assertRaises(ValueError):
+            import_records(p2, read_records(
+                ['{"type": "edge", "source": "a", "sink": "x"}'], 'jsonl'))
+        db.session.rollback()
+        with self.assertRaises(CycleError):
+            import_records(p2, read_records(
+                ['{"type": "edge", "source": "c", "sink": "a"}'], 'jsonl'))
+        db.session.rollback()
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(u.id)
+            session['_fresh'] = True
+        response = client.get('/project/{}/export'.format(p1.id))
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        self.assertEqual(response.data.decode().count('\n'), 5)
+        response = client.post('/project/{}/import'.format(p1.id),
+                               data='type,id\nnode,d\n',
+                               content_type='text/csv')
+        self.assertEqual(response.get_json()['nodes'], 1)
+        self.assertEqual(Node.query.filter_by(external_id='d').one()
+                         .created_by, u)
+        for body in ('[1, 2]\n', '{"type": "node", "id": {"x": 1}}\n',
+                     '{"type": "node", "id": "e", "name": {"x": 1}}\n',
+                     '{"type": "edge", "source": "a", "sink": [1]}\n'):
+            response = client.post('/project/{}/import'.format(p1.id),
+                                   data=body,
+                                   content_type='application/x-ndjson')
+            self.assertEqual(response.status_code, 400)
+        # a cross-site form could post text/plain
+        response = client.post('/project/{}/import'.format(p1.id),
+                               data='{"type": "node", "id": "f"}\n',
+                               content_type='text/plain')
+        self.assertEqual(response.status_code, 415)
+
+        # nodes created in the UI are exported and matched by their id
+        p3 = Project(name="UI", created_by=u)
+        n0, n1 = Node(name="n0", project=p3), Node(name="n1", project=p3)
+        db.session.add_all([p3, n0, n1])
+        db.session.commit()
+        n0.add_sink(n1)
+        # edges into other projects are not exported
+        n0.add_sink(Node.query.filter_by(external_id='d').one())
+        db.session.commit()
+        lines = list(write_records(export_records(p3), 'jsonl'))
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(import_records(p3, read_records(lines, 'jsonl')),
+                         (0, 0))
+        self.assertEqual(p3.nodes.count(), 2)
+        self.assertEqual(p3.edges.count(), 2)
+
+    def test_database_search(self):
+        u = User(username='susan', email='susan@example.com')
+        kitchen = Project(name="Kitchen", created_by=u)
+        garden = Project(name="Garden", created_by=u)
+        sink = Node(name="Kitchen sink", project=garden)
+        db.session.add_all([u, kitchen, garden, sink,
+                            Node(name="Tiles", project=kitchen)])
+        db.session.commit()
+
+        projects, total = Project.search('kitch', 1, 10)
+        # a match in the project name ranks above one in a node name
+        self.assertEqual((projects.all(), total), ([kitchen, garden], 2))
+        projects, total = Project.search('kitchen', 2, 1)
+        self.assertEqual((projects.all(), total), ([garden], 2))
+        self.assertEqual(Node.search('sink', 1, 10)[0].all(), [sink])
+        self.assertEqual(Project.search('"*', 1, 10)[1], 0)
+
+        sink.name = 'Hedge'
+        kitchen.name = 'Bathroom'
+        db.session.commit()
+        self.assertEqual(Project.search('kitchen', 1, 10)[1], 0)
+        self.assertEqual(Project.search('hedge', 1, 10)[0].all(), [garden])
+        sink.delete()
+        garden.delete()
+        db.session.commit()
+        self.assertEqual(Project.search('garden hedge', 1, 10)[1], 0)
+        self.assertEqual(db.session.execute(
+            'SELECT count(*) FROM search_entry').scalar(), 2)
+
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(u.id)
+            session['_fresh'] = True
+        response = client.get('/search?q=tiles')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Bathroom', response.data)
+
+    def test_indexing_queue(self):
+        now, sleeps = [0.0], []
+        client = FakeElasticsearch(fail=1, reject=[2])
+        queue = IndexingQueue(client, batch_size=2, start=False,
+                              clock=lambda: now[0], sleep=sleeps.append)
+        queue.put([('index', 'project', 1, {'name': 'a'}),
+                   ('index', 'project', 2, {'name': 'b'})])
+        now[0] = 3.0
+        queue.put([('index', 'project', 1, {'name': 'c'}),
+                   ('delete', 'node', 5, None)])
+        self.assertEqual(len(queue), 3)
+        self.assertEqual(queue.lag(), 3.0)
+        queue.flush()
+        self.assertEqual(client.documents, {('project', 1): {'name': 'c'},
+                                            ('project', 2): {'name': 'b'}})
+        # one failed request and one rejected item, both retried
+        self.assertEqual(len(client.requests), 4)
+        self.assertEqual(sleeps, [0.5, 1.0])
+        self.assertEqual(queue.report(), {'pending': 0, 'lag': 0.0,
+                                          'sent': 3, 'failed': 0,
+                                          'retried': 3})
+
+        client = FakeElasticsearch(fail=10)
+        queue = IndexingQueue(client, retries=2, start=False,
+                              sleep=sleeps.append)
+        queue.put([('delete', 'project', 1, None)])
+        queue.flush()
+        self.assertEqual((len(client.requests), queue.failed), (3, 1))
+
+        client = FakeElasticsearch()
+        queue = IndexingQueue(client, interval=0.01)
+        queue.put([('index', 'project', 1, {'name': 'a'})])
+        queue.close()
+        self.assertEqual(queue.sent, 1)
+
+    def test_elasticsearch_backend_sync(self):
+        client = FakeElasticsearch()
+        queue = IndexingQueue(client, start=False)
+        self.app.search = ElasticsearchBackend(client, queue)
+        p = Project(name="Kitchen")
+        db.session.add(p)
+        db.session.flush()
+        self.assertEqual(len(queue), 0)
+        db.session.commit()
+        n = Node(name="Tiles", project=p)
+        db.session.add(n)
+        db.session.flush()
+        db.session.rollback()
+        self.assertEqual(len(queue), 1)
+        p.name = 'Bathroom'
+        db.session.commit()
+        queue.flush()
+        self.assertEqual(client.documents,
+                         {('project', p.id): {'name': 'Bathroom'}})
+        self.assertEqual(len(client.requests), 1)
+        db.session.delete(p)
+        db.session.commit()
+        queue.flush()
+        self.assertEqual(client.documents, {})
+
+        # nodes deleted in bulk with their project leave the index, too
+        p = Project(name="Kitchen")
+        db.session.add_all([p, Node(name="Tiles", project=p)])
+        db.session.commit()
+        queue.flush()
+        self.assertEqual(len(client.documents), 2)
+        p.delete()
+        db.session.commit()
+        queue.flush()
+        self.assertEqual(client.documents, {})
+
+    def test_reindex_command(self):
+        p = Project(name="Kitchen")
+        db.session.add(p)
+        db.session.commit()
+        db.session.execute(Node.__table__.insert(), [
+            {'name': 'n{}'.format(i), 'project_id': p.id} for i in range(25)])
+        db.session.commit()
+        self.assertEqual(Node.search('n24', 1, 10)[1], 0)
+
+        cli.register(self.app)
+        runner = self.app.test_cli_runner()
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = os.path.join(directory, '.reindex-node')
+            with open(checkpoint, 'w') as f:
+                f.write('20')
+            result = runner.invoke(args=[
+                'search', 'reindex', 'node', '--range-size', '10',
+                '--chunk-size', '3', '--checkpoint-dir', directory])
+            self.assertEqual(result.exit_code, 0, result.output)
+            self.assertIn('resuming after id 20', result.output)
+            self.assertIn('5 of 5 rows up to id 25', result.output)
+            self.assertFalse(os.path.exists(checkpoint))
+            self.assertEqual(Node.search('n24', 1, 10)[1], 1)
+            self.assertEqual(Node.search('n10', 1, 10)[1], 0)
+
+            result = runner.invoke(args=[
+                'search', 'reindex', '--range-size', '10',
+                '--checkpoint-dir', directory])
+        self.assertIn('project: 1 of 1 rows', result.output)
+        self.assertEqual(Node.search('n10', 1, 10)[1], 1)
+
+        result = runner.invoke(args=['search', 'reindex', '--workers', '0'])
+        self.assertNotEqual(result.exit_code, 0)
+        self.assertIn('--workers', result.output)
+
+    def test_parallel_reindex(self):
+        # worker threads need a database they share
+        db.session.remove()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = (
+            'sqlite:///' + os.path.join(directory.name, 'app.db'))
+        self.app.extensions['sqlalchemy'].connectors.clear()
+        db.create_all()
+        p = Project(name="Kitchen")
+        db.session.add(p)
+        db.session.commit()
+        db.session.execute(Node.__table__.insert(), [
+            {'name': 'n{}'.format(i), 'project_id': p.id} for i in range(50)])
+        db.session.commit()
+        client = FakeElasticsearch()
+        self.app.search = ElasticsearchBackend(
+            client, IndexingQueue(client, start=False))
+
+        progress = list(reindex(Node, after=5, workers=3, range_size=10,
+                                chunk_size=4))
+        self.assertEqual(progress[-1], (50, 45))
+        self.assertEqual([last for last, _ in progress],
+                         sorted(last for last, _ in progress))
+        self.assertEqual(sorted(id for _, id in client.documents),
+                         list(range(6, 51)))
+
+    def test_delete_is_set_based(self):
+        def delete_statements(size):
+            p = Project(name="Test Project")
+            other = Project(name="Other Project")
+            n = [Node(name="n{}".format(i), project=p) for i in range(size)]
+            outside = Node(name="outside", project=other)
+            db.session.add_all([p, other, outside] + n)
+            db.session.commit()
+            p.connect_many(zip([node.id for node in n[1:]],
+                               [node.id for node in n]))
+            outside.add_sink(n[0])
+            db.session.commit()
+
+            with self.count_statements() as statements:
+                n[1].delete()
+                p.delete()
+                db.session.commit()
+            self.assertEqual(Node.query.all(), [outside])
+            self.assertEqual(Edge.query.all(), [])
+            self.assertTrue(other.components_stale)
+            outside.delete()
+            other.delete()
+            db.session.commit()
+            return len(statements)
+
+        self.assertEqual(delete_statements(5), delete_statements(50))
+
+    def test_prefetch_node_page(self):
+        u = User(username='susan', email='susan@example.com')
+        p = Project(name="Test Project", created_by=u)
+        n = [Node(name="n{}".format(i), project=p, created_by=u)
+             for i in range(21)]
+        db.session.add_all([u, p] + n)
+        db.session.commit()
+        ids = [node.id for node in n]
+        p.connect_many([(i, ids[0]) for i in ids[1:11]] +
+                       [(ids[0], i) for i in ids[11:]])
+        db.session.commit()
+        db.session.expire_all()
+
+        with self.count_statements() as statements:
+            page = Node.load_page(ids[0])
+            names = [node.created_by.username
+                     for node in page.sources + page.sinks + [page.node]]
+            project_name = page.node.project.name
+            nodes = Project.load_nodes(p.id)
+            names += [node.created_by.username for node in nodes]
+        self.assertEqual(len(statements), 4)
+        self.assertEqual([node.id for node in page.sources], ids[1:11])
+        self.assertEqual([node.id for node in page.sinks], ids[11:])
+        self.assertEqual(project_name, "Test Project")
+        self.assertEqual(set(names), {'susan'})
+        self.assertIsNone(Node.load_page(ids[-1] + 1))
+
     def test_graph(self):
         def set_of_set(list):
             sets = set()
@@ -209,12 +1083,299 @@ class UserModelCase(unittest.TestCase):
         self.assertEqual(len(edges), 6)
         self.assertTrue(["f"] in graph.connected_components())
         self.assertEqual(len(graph.connected_components()), 2)
+        self.assertEqual(set_of_set(graph.weak_components()),
+                         set_of_set(graph.connected_components()))
         self.assertTrue(graph.topsort())
 
         g["e"].append("d")
         graph = Graph(g)
-        self.assertFalse(graph.topsort())
+        with self.assertRaises(CycleError) as context:
+            graph.topsort()
+        self.assertEqual(set(context.exception.cycle), {"d", "e"})
+
+    def test_schedule(self):
+        # a --> b --> d
+        # a --> c --> d, c takes longer than b
+        g = {
+            "a": ["b", "c"],
+            "b": ["d"],
+            "c": ["d"],
+            "d": [],
+            "e": []
+            }
+        schedule = Graph(g).schedule(durations={"c": 3})
+        self.assertEqual(schedule.duration, 5)
+        self.assertEqual(schedule.critical_path, ["a", "c", "d"])
+        self.assertEqual(schedule.earliest_start,
+                         {"a": 0, "b": 1, "c": 1, "d": 4, "e": 0})
+        self.assertEqual(schedule.latest_finish,
+                         {"a": 1, "b": 4, "c": 4, "d": 5, "e": 5})
+        self.assertEqual(schedule.slack,
+                         {"a": 0, "b": 2, "c": 0, "d": 0, "e": 4})
+
+        g["d"].append("a")
+        with self.assertRaises(CycleError):
+            Graph(g).schedule()
+
+    def test_transitive_closure_and_reduction(self):
+        g = {
+            "a": ["b", "c", "d"],
+            "b": ["c"],
+            "c": ["d"],
+            "d": [],
+            "e": ["d"]
+            }
+        graph = Graph(g)
+        snapshot = graph.snapshot()
+        self.assertTrue(snapshot.reaches("a", "d"))
+        self.assertTrue(snapshot.reaches("e", "d"))
+        self.assertFalse(snapshot.reaches("d", "a"))
+        self.assertFalse(snapshot.reaches("a", "e"))
+        self.assertEqual(sorted(graph.redundant_edges()),
+                         [["a", "c"], ["a", "d"]])
+        reduction = graph.transitive_reduction()
+        self.assertEqual(sorted(reduction.edges()),
+                         [["a", "b"], ["b", "c"], ["c", "d"], ["e", "d"]])
+        self.assertEqual(reduction.redundant_edges(), [])
 
+    def test_remove_redundant_edges(self):
+        p = Project(name="Test Project")
+        n0 = Node(name="n0", project=p)
+        n1 = Node(name="n1", project=p)
+        n2 = Node(name="n2", project=p)
+        db.session.add_all([p, n0, n1, n2])
+        db.session.commit()
+        n0.add_sink(n1)
+        n1.add_sink(n2)
+        n0.add_sink(n2)
+        db.session.commit()
+        self.assertEqual(p.analysis()['redundant_edges'], [[n0.id, n2.id]])
+        self.assertEqual(p.remove_redundant_edges(), 1)
+        db.session.commit()
+        self.assertEqual(n0.sinks(), [n1])
+        self.assertEqual(p.analysis()['redundant_edges'], [])
+
+        # no transitive closure for large projects
+        self.app.config['ANALYSIS_MAX_CLOSURE_NODES'] = 2
+        n1.add_sink(Node(name="n3", project=p))
+        db.session.commit()
+        self.assertIsNone(p.analysis()['redundant_edges'])
+        self.assertEqual(p.remove_redundant_edges(), 0)
+
+    def test_graph_deep_chain(self):
+        length = 5000
+        g = {i: [i + 1] for i in range(length)}
+        g[length] = []
+        graph = Graph(g)
+        self.assertEqual(graph.topsort(), list(range(length + 1)))
+        self.assertEqual(len(graph.depth_first_search(0)), length + 1)
+        self.assertEqual(len(graph.snapshot().topsort()), length + 1)
+
+        g[length].append(0)
+        with self.assertRaises(CycleError) as context:
+            Graph(g).snapshot().topsort()
+        self.assertEqual(len(context.exception.cycle), length + 1)
+
+    def test_graph_edge_store(self):
+        graph = Graph()
+        for i in range(20000):
+            graph.add_edge([i, i + 1])
+        graph.add_edge([0, 1])
+        self.assertEqual(len(graph.edges()), 20000)
+        self.assertTrue(graph.has_edge([0, 1]))
+        self.assertFalse(graph.has_edge([1, 0]))
+        self.assertEqual(graph.sources(1), [0])
+        graph.remove_edge([0, 1])
+        self.assertFalse(graph.has_edge([0, 1]))
+        self.assertEqual(graph.sources(1), [])
+        self.assertEqual(graph.sinks(0), [])
+        self.assertEqual(len(graph.connected_components()), 2)
+
+        undirected = graph.undirected()
+        self.assertTrue(undirected.has_edge([2, 1]))
+        self.assertEqual(undirected.sinks(2), [3, 1])
+        self.assertEqual(len(undirected.depth_first_search(20000)), 20000)
+        self.assertEqual(graph.depth_first_search(1, "backward"), [1])
+        graph.add_edge([2, 0])
+        self.assertEqual(len(undirected.depth_first_search(0)), 20001)
+
+    def test_compact_graph(self):
+        g = {
+            "a": ["b"],
+            "b": ["c", "d"],
+            "c": ["d"],
+            "d": [],
+            "e": []
+            }
+        graph = Graph(g)
+        snapshot = graph.snapshot()
+        self.assertIsInstance(snapshot, CompactGraph)
+        self.assertEqual(snapshot.nodes(), graph.nodes())
+        self.assertEqual(snapshot.edges(), graph.edges())
+        self.assertEqual(snapshot.sinks("b"), ["c", "d"])
+        self.assertEqual(snapshot.sources("d"), ["b", "c"])
+        self.assertEqual(snapshot.connected_components(),
+                         [["a", "b", "c", "d"], ["e"]])
+        order = snapshot.topsort()
+        for [source, sink] in snapshot.edges():
+            self.assertLess(order.index(source), order.index(sink))
+
+        snapshot = CompactGraph(edges=[("d", "a")] + graph.edges())
+        with self.assertRaises(CycleError):
+            snapshot.topsort()
+
+    def test_project_snapshot(self):
+        p = Project(name="Test Project")
+        n0 = Node(name="n0", project=p)
+        n1 = Node(name="n1", project=p)
+        n2 = Node(name="n2", project=p)
+        n3 = Node(name="n3", project=p)
+        db.session.add_all([p, n0, n1, n2, n3])
+        db.session.commit()
+        n1.add_sink(n0)
+        n1.add_source(n2)
+        db.session.commit()
+        snapshot = p.snapshot()
+        self.assertEqual(set(snapshot.nodes()),
+                         {n0.id, n1.id, n2.id, n3.id})
+        self.assertEqual(sorted(snapshot.edges()),
+                         sorted([[n1.id, n0.id], [n2.id, n1.id]]))
+        self.assertEqual(len(snapshot.connected_components()), 2)
+
+
+    def test_mail_worker(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', DeprecationWarning)
+            try:
+                import asyncore
+                import smtpd
+            except ImportError:
+                self.skipTest('smtpd is not available')
+
+        class DebuggingServer(smtpd.SMTPServer):
+            connections = 0
+            messages = []
+
+            def handle_accepted(self, conn, addr):
+                DebuggingServer.connections += 1
+                super().handle_accepted(conn, addr)
+
+            def process_message(self, peer, mailfrom, rcpttos, data, **kwargs):
+                DebuggingServer.messages.append(rcpttos)
+
+        server = DebuggingServer(('127.0.0.1', 0), None)
+        thread = threading.Thread(target=asyncore.loop,
+                                  kwargs={'timeout': 0.05}, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.close)
+
+        class MailConfig(TestConfig):
+            MAIL_SERVER = '127.0.0.1'
+            MAIL_PORT = server.socket.getsockname()[1]
+            MAIL_SUPPRESS_SEND = False
+            MAIL_WORKERS = 1
+            MAIL_BATCH_SIZE = 10
+
+        app = create_app(MailConfig)
+        with app.app_context():
+            # queue four messages before the worker starts, so that
+            # all five go out as one batch over one connection, a broken
+            # message only fails itself
+            pool = app.extensions['mail_worker']
+            pool.queue.put(Message('bad\nheader',
+                                   sender='tawachai@example.com',
+                                   recipients=['user@example.com']))
+            for i in range(4):
+                pool.queue.put(Message('hello', sender='tawachai@example.com',
+                                       recipients=['user%d@example.com' % i]))
+            send_email('hello', 'tawachai@example.com', ['user4@example.com'],
+                       'text', '<p>html</p>')
+            mail_worker.close(timeout=10)
+            self.assertEqual(mail_worker.report(),
+                             {'queued': 0, 'sent': 5, 'failed': 1})
+        self.assertEqual(sorted(DebuggingServer.messages),
+                         [['user%d@example.com' % i] for i in range(5)])
+        self.assertEqual(DebuggingServer.connections, 1)
+
+    def test_conditional_get(self):
+        u1 = User(username='susan', email='susan@example.com')
+        u2 = User(username='john', email='john@example.com')
+        p = Project(name="Test Project", created_by=u1)
+        n = [Node(name="n{}".format(i), project=p, created_by=u2)
+             for i in range(2)]
+        db.session.add_all([u1, u2, p] + n)
+        db.session.commit()
+        user_ids = [str(u1.id), str(u2.id)]
+        client = self.app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = user_ids[0]
+            session['_fresh'] = True
+        # the first render stores the CSRF token in the session
+        client.get('/project/{}'.format(p.id))
+        db.session.remove()
+
+        for url in ('/project/{}'.format(p.id),
+                    '/project/{}/analyze'.format(p.id)):
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            etag = response.headers['ETag']
+            last_modified = response.headers['Last-Modified']
+            self.assertIn('private', response.headers['Cache-Control'])
+            db.session.remove()
+
+            with self.count_statements() as statements:
+                response = client.get(url, headers={'If-None-Match': etag})
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response.headers['ETag'], etag)
+            self.assertFalse([s for s in statements if 'FROM edge' in s])
+            db.session.remove()
+            # dates are too coarse, only the ETag counts
+            response = client.get(url, headers={
+                'If-Modified-Since': last_modified})
+            self.assertEqual(response.status_code, 200)
+            db.session.remove()
+        response = client.get('/node/{}'.format(n[0].id))
+        self.assertNotIn('ETag', response.headers)
+        db.session.remove()
+
+        url = '/project/{}'.format(p.id)
+        etag = client.get(url).headers['ETag']
+        db.session.remove()
+        # another user gets another page
+        with client.session_transaction() as session:
+            session['_user_id'] = user_ids[1]
+        response = client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        db.session.remove()
+        with client.session_transaction() as session:
+            session['_user_id'] = user_ids[0]
+        self.assertEqual(client.get(url, headers={'If-None-Match': etag})
+                         .status_code, 304)
+        db.session.remove()
+
+        # renaming a node or the project changes the page
+        Node.query.get(n[1].id).name = 'renamed'
+        db.session.commit()
+        db.session.remove()
+        response = client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        db.session.remove()
+        Project.query.get(p.id).name = 'New Name'
+        db.session.commit()
+        db.session.remove()
+        response = client.get(url, headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        etag = response.headers['ETag']
+        db.session.remove()
+
+        # so does renaming the creator of a node
+        User.query.get(u2.id).username = 'johnny'
+        db.session.commit()
+        db.session.remove()
+        self.assertEqual(client.get(url, headers={'If-None-Match': etag})
+                         .status_code, 200)
 
 
 if __name__ == '__main__':